@@ -0,0 +1,18 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.min_io.client import ensure_buckets
+from app.mongodb.client import ensure_indexes
+from app.utils.log import logger
+
+
+def bootstrap():
+    """
+    Create the MinIO buckets and Mongo indexes the app relies on.
+    Importing the app has no side effects, run this once at startup.
+    """
+    ensure_buckets()
+    ensure_indexes()
+    logger.info("MinIO buckets and Mongo indexes are ready")
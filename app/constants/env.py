@@ -4,7 +4,103 @@ from dotenv import load_dotenv
 load_dotenv(override=True)
 
 mongo_db_host = os.getenv("MONGO_DB_HOST")
+mongo_db_name = os.getenv("MONGO_DB_NAME", "music-playlist")
 
 minio_access_key = os.getenv("MINIO_ACCESS_KEY")
 minio_secret_key = os.getenv("MINIO_SECRET_KEY")
 minio_endpoint = os.getenv("MINIO_ENDPOINT")
+minio_bucket = os.getenv("MINIO_BUCKET", "music-playlist")
+
+# weapi host, point it at a stand-in server to run without music.163.com
+netease_base_url = os.getenv("NETEASE_BASE_URL", "https://music.163.com")
+
+download_concurrency = int(os.getenv("DOWNLOAD_CONCURRENCY", "8"))
+download_per_host_limit = int(os.getenv("DOWNLOAD_PER_HOST_LIMIT", "4"))
+download_chunk_size = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(64 * 1024)))
+download_max_chunk_size = int(os.getenv("DOWNLOAD_MAX_CHUNK_SIZE", str(1024 * 1024)))
+download_timeout = float(os.getenv("DOWNLOAD_TIMEOUT", "30"))
+
+playlist_page_size = int(os.getenv("PLAYLIST_PAGE_SIZE", "1000"))
+song_detail_batch_size = int(os.getenv("SONG_DETAIL_BATCH_SIZE", "500"))
+netease_api_concurrency = int(os.getenv("NETEASE_API_CONCURRENCY", "4"))
+
+netease_pool_size = int(os.getenv("NETEASE_POOL_SIZE", "10"))
+netease_timeout = float(os.getenv("NETEASE_TIMEOUT", "15"))
+netease_max_retries = int(os.getenv("NETEASE_MAX_RETRIES", "3"))
+netease_backoff_factor = float(os.getenv("NETEASE_BACKOFF_FACTOR", "0.5"))
+# Requests, and seconds (0 for no limit), a weapi key pair is used for.
+# Every pair costs an RSA modpow, one per request with the default of 1
+weapi_key_max_uses = int(os.getenv("WEAPI_KEY_MAX_USES", "1"))
+weapi_key_ttl = float(os.getenv("WEAPI_KEY_TTL", "0"))
+
+minio_part_size = int(os.getenv("MINIO_PART_SIZE", str(8 * 1024 * 1024)))
+minio_parallel_uploads = int(os.getenv("MINIO_PARALLEL_UPLOADS", "4"))
+# Keys a batch song lookup lists before stat-ing the songs it did not
+# reach, minio_stat_concurrency at a time
+minio_list_max_keys = int(os.getenv("MINIO_LIST_MAX_KEYS", "1000"))
+minio_stat_concurrency = int(os.getenv("MINIO_STAT_CONCURRENCY", "8"))
+
+song_cache_size = int(os.getenv("SONG_CACHE_SIZE", "10000"))
+song_cache_ttl = float(os.getenv("SONG_CACHE_TTL", "600"))
+url_cache_size = int(os.getenv("URL_CACHE_SIZE", "10000"))
+# Presigned urls are valid for 7 days, refresh them long before that
+minio_url_ttl = float(os.getenv("MINIO_URL_TTL", "3600"))
+# Used when Netease does not say when a url expires
+netease_url_ttl = float(os.getenv("NETEASE_URL_TTL", "600"))
+
+netease_rate_limit = float(os.getenv("NETEASE_RATE_LIMIT", "10"))
+netease_rate_burst = int(os.getenv("NETEASE_RATE_BURST", "20"))
+
+# Seconds a claimed job stays leased to a worker without a heartbeat
+job_lease_seconds = float(os.getenv("JOB_LEASE_SECONDS", "120"))
+job_heartbeat_interval = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "30"))
+job_max_attempts = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+# Delay before the first retry, doubled on every further attempt
+job_retry_backoff = float(os.getenv("JOB_RETRY_BACKOFF", "30"))
+job_poll_interval = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+# Songs per download job enqueued by a playlist job
+job_song_batch_size = int(os.getenv("JOB_SONG_BATCH_SIZE", "50"))
+# Seconds done jobs are kept before Mongo deletes them, dead ones are kept
+job_done_ttl = int(os.getenv("JOB_DONE_TTL", str(7 * 24 * 3600)))
+worker_processes = int(os.getenv("WORKER_PROCESSES", "2"))
+
+log_level = os.getenv("LOG_LEVEL", "INFO")
+# Write console and file logs from background threads instead of the caller
+log_background = os.getenv("LOG_BACKGROUND", "true").lower() in ("1", "true", "yes")
+# Per-item messages are logged once every log_sample_every items at INFO,
+# the rest at DEBUG. 1 logs every item, 0 only the batch summaries
+log_sample_every = int(os.getenv("LOG_SAMPLE_EVERY", "100"))
+
+# Connection pool of each Mongo client, sync and async
+mongo_max_pool_size = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+mongo_min_pool_size = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+
+# Objects streamed ahead of the one being written to an export archive,
+# and how much of each is buffered in memory meanwhile
+export_concurrency = int(os.getenv("EXPORT_CONCURRENCY", "8"))
+export_buffer_size = int(os.getenv("EXPORT_BUFFER_SIZE", str(4 * 1024 * 1024)))
+
+# Per-stage latency histograms, counters and trace spans, see utils/metrics.
+# Read at import, instrumented functions are left untouched when disabled
+metrics_enabled = os.getenv("METRICS_ENABLED", "false").lower() in ("1", "true", "yes")
+# Serve /metrics (Prometheus text) and /metrics.json on this port, 0 for off
+metrics_port = int(os.getenv("METRICS_PORT", "0"))
+# Write the JSON snapshot here every metrics_dump_interval seconds and at
+# exit, empty for off. {pid} is replaced so worker processes don't collide
+metrics_dump_path = os.getenv("METRICS_DUMP_PATH", "")
+metrics_dump_interval = float(os.getenv("METRICS_DUMP_INTERVAL", "60"))
+# Most recent traced spans kept for the JSON snapshot
+metrics_span_buffer = int(os.getenv("METRICS_SPAN_BUFFER", "1000"))
+
+# Processes rendering SRT files of a playlist lyric export, 0 for one per
+# cpu, and songs handed to a process at a time
+lyric_render_processes = int(os.getenv("LYRIC_RENDER_PROCESSES", "0"))
+lyric_render_chunk = int(os.getenv("LYRIC_RENDER_CHUNK", "500"))
+
+# Local disk tier in front of MinIO, "" to turn it off. Downloaded audio is
+# kept here up to local_cache_max_bytes (0 for no cap), evicting the least
+# recently ("lru") or least often ("lfu") used files first. The cache owns
+# the directory, keep it apart from the download directory
+local_cache_dir = os.getenv("LOCAL_CACHE_DIR", "music_cache")
+local_cache_max_bytes = int(os.getenv("LOCAL_CACHE_MAX_BYTES", str(20 * 1024**3)))
+local_cache_policy = os.getenv("LOCAL_CACHE_POLICY", "lru").lower()
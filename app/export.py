@@ -0,0 +1,256 @@
+import io
+import os
+import queue
+import shutil
+import sys
+import tarfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator, Optional
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.constants.env import export_buffer_size, export_concurrency
+from app.min_io.client import BucketName
+from app.min_io.services import open_object
+from app.mongodb.playlist import get_playlist
+from app.mongodb.records import Song
+from app.mongodb.song import get_songs
+from app.netease.downloader import TeeReader
+from app.utils.filename import safe_filename
+from app.utils.log import SampledLog, logger
+from app.utils.metrics import add_bytes, timed
+
+CHUNK_SIZE = 256 * 1024
+
+
+@dataclass
+class ExportTrack:
+    song: Song
+    object_name: str
+    # Path of the track inside the archive
+    filename: str
+    md5: Optional[str] = None
+
+
+def export_tracks(songs: list[Song]) -> list[ExportTrack]:
+    """
+    Tracks to export for songs, numbered in playlist order. Songs whose
+    audio metadata is not recorded are looked up under their legacy
+    {id}.mp3 object.
+    """
+    width = max(2, len(str(len(songs))))
+    tracks = []
+    for number, song in enumerate(songs, 1):
+        audio = song.audio or {}
+        fmt = audio.get("format") or "mp3"
+        title = safe_filename(f"{song.singer_name} - {song.name}")
+        tracks.append(
+            ExportTrack(
+                song,
+                audio.get("object") or f"{song.id}.mp3",
+                f"{number:0{width}d} - {title}.{fmt}",
+                audio.get("md5"),
+            )
+        )
+    return tracks
+
+
+def m3u_playlist(tracks: list[ExportTrack]) -> bytes:
+    lines = ["#EXTM3U"]
+    for track in tracks:
+        lines.append(f"#EXTINF:-1,{track.song.singer_name} - {track.song.name}")
+        lines.append(track.filename)
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class Prefetch:
+    """
+    Streams one object from MinIO into a bounded queue of chunks on a
+    worker thread, so the next objects download while the current one is
+    written. At most buffer_size bytes of the object wait in memory.
+    """
+
+    def __init__(self, object_name: str, bucket_name: str, buffer_size: int):
+        self.object_name = object_name
+        self.bucket_name = bucket_name
+        self.size = 0
+        self.found = False
+        self.error: Optional[Exception] = None
+        self.ready = threading.Event()
+        self.cancelled = threading.Event()
+        self._chunks = queue.Queue(maxsize=max(1, buffer_size // CHUNK_SIZE))
+
+    def run(self):
+        try:
+            response = open_object(self.object_name, self.bucket_name)
+        except Exception as e:
+            response = None
+            self.error = e
+        if response is None:
+            self.ready.set()
+            return
+        self.found = True
+        self.size = int(response.headers.get("Content-Length", 0))
+        self.ready.set()
+        try:
+            for chunk in response.stream(CHUNK_SIZE):
+                if not self._put(chunk):
+                    return
+            self._put(None)
+        except Exception as e:
+            self._put(e)
+        finally:
+            response.close()
+            response.release_conn()
+
+    def chunks(self) -> Iterator[bytes]:
+        while True:
+            chunk = self._chunks.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+    def _put(self, item) -> bool:
+        # Blocks while the buffer is full, gives up once cancelled
+        while not self.cancelled.is_set():
+            try:
+                self._chunks.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+
+class TarArchive:
+    def __init__(self, out: BinaryIO):
+        # stream mode writes sequentially and never seeks
+        self._tar = tarfile.open(fileobj=out, mode="w|")
+
+    def add(self, filename: str, size: int, data):
+        info = tarfile.TarInfo(filename)
+        info.size = size
+        info.mtime = int(time.time())
+        self._tar.addfile(info, data)
+
+    def close(self):
+        self._tar.close()
+
+
+class ZipArchive:
+    def __init__(self, out: BinaryIO):
+        # Audio is already compressed, store it as is. On a stream that
+        # can't seek, sizes and crcs go in data descriptors after each file
+        self._zip = zipfile.ZipFile(out, "w", compression=zipfile.ZIP_STORED)
+
+    def add(self, filename: str, size: int, data):
+        info = zipfile.ZipInfo(filename, time.localtime()[:6])
+        info.file_size = size
+        with self._zip.open(info, "w") as dest:
+            shutil.copyfileobj(data, dest, CHUNK_SIZE)
+
+    def close(self):
+        self._zip.close()
+
+
+@timed("playlist.export", trace="playlist_id")
+def export_playlist(
+    playlist_id,
+    out: BinaryIO,
+    archive_format: str = "tar",
+    bucket_name: str = BucketName.MUSIC_PLAYLIST.value,
+    concurrency: int = export_concurrency,
+    buffer_size: int = export_buffer_size,
+) -> Optional[dict]:
+    """
+    Write the stored audio of a playlist to out as a tar or zip archive,
+    with an M3U playlist of the exported tracks.
+
+    Up to concurrency objects stream from MinIO at once and are written in
+    playlist order, straight from memory buffers of at most buffer_size
+    each, so nothing is staged on disk and memory stays constant. out can
+    be any writable binary stream, e.g. stdout. Tracks not in MinIO are
+    skipped.
+    """
+    playlist = get_playlist(playlist_id)
+    if playlist is None:
+        logger.error(f"Playlist {playlist_id} not found in db")
+        return None
+    songs, missing_ids = get_songs(playlist.track_ids)
+    if missing_ids:
+        logger.warning(f"{len(missing_ids)} tracks of {playlist.name} not in db")
+    tracks = export_tracks(songs)
+    logger.info(
+        f"Exporting {len(tracks)} tracks of playlist {playlist.name} as {archive_format}"
+    )
+
+    archive = ZipArchive(out) if archive_format == "zip" else TarArchive(out)
+    exported = []
+    skipped = []
+    total = 0
+    written = SampledLog(f"Exported {playlist.name}")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        prefetches = []
+
+        def submit(index: int):
+            if index < len(tracks):
+                prefetch = Prefetch(tracks[index].object_name, bucket_name, buffer_size)
+                prefetches.append(prefetch)
+                executor.submit(prefetch.run)
+
+        for index in range(concurrency):
+            submit(index)
+        try:
+            for index, track in enumerate(tracks):
+                prefetch = prefetches[index]
+                prefetch.ready.wait()
+                if prefetch.error:
+                    logger.error(f"Failed to get {track.object_name}: {prefetch.error}")
+                if not prefetch.found:
+                    skipped.append(track.song.id)
+                else:
+                    reader = TeeReader(prefetch.chunks())
+                    archive.add(track.filename, prefetch.size, reader)
+                    if track.md5 and reader.md5.hexdigest() != track.md5:
+                        logger.error(
+                            f"Checksum mismatch for {track.object_name} in export"
+                        )
+                    exported.append(track)
+                    total += prefetch.size
+                    add_bytes("minio.get", prefetch.size)
+                    written.item("Exported {}", track.filename)
+                # frees the fetch thread, which may still hold the end marker
+                prefetch.cancelled.set()
+                submit(index + concurrency)
+            manifest = m3u_playlist(exported)
+            archive.add(
+                f"{safe_filename(playlist.name)}.m3u8",
+                len(manifest),
+                io.BytesIO(manifest),
+            )
+            archive.close()
+        finally:
+            for prefetch in prefetches:
+                prefetch.cancelled.set()
+
+    elapsed = time.perf_counter() - start
+    written.summary(
+        "{} skipped, {:.1f} MiB in {:.1f}s",
+        len(skipped),
+        total / 1024 / 1024,
+        elapsed,
+    )
+    if skipped:
+        logger.warning(f"Tracks not in MinIO, not exported: {skipped}")
+    return {
+        "id": playlist_id,
+        "exported": len(exported),
+        "skipped": skipped,
+        "bytes": total,
+    }
@@ -1,3 +1,4 @@
+from functools import cache
 from minio import Minio
 from minio.error import S3Error
 from enum import Enum
@@ -5,22 +6,29 @@ from constants.env import (
     minio_access_key,
     minio_secret_key,
     minio_endpoint,
+    minio_bucket,
 )
 
-minio_client = Minio(
-    endpoint=minio_endpoint,
-    access_key=minio_access_key,
-    secret_key=minio_secret_key,
-    secure=False,
-)
+
+@cache
+def get_minio_client() -> Minio:
+    # Built on first use so importing this module needs no MinIO server
+    return Minio(
+        endpoint=minio_endpoint,
+        access_key=minio_access_key,
+        secret_key=minio_secret_key,
+        secure=False,
+    )
 
 
 class BucketName(Enum):
-    MUSIC_PLAYLIST = "music-playlist"
+    MUSIC_PLAYLIST = minio_bucket
 
 
-# Loop through bucket names and create if they don't exist
-for bucket in BucketName:
-    found = minio_client.bucket_exists(bucket.value)
-    if not found:
-        minio_client.make_bucket(bucket.value)
+def ensure_buckets():
+    """Loop through bucket names and create if they don't exist"""
+    minio_client = get_minio_client()
+    for bucket in BucketName:
+        found = minio_client.bucket_exists(bucket.value)
+        if not found:
+            minio_client.make_bucket(bucket.value)
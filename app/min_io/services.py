@@ -1,10 +1,20 @@
 from minio.error import S3Error
+import asyncio
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from min_io.client import minio_client, BucketName
+from min_io.client import get_minio_client, BucketName
+from constants.env import (
+    minio_part_size,
+    minio_parallel_uploads,
+    minio_list_max_keys,
+    minio_stat_concurrency,
+)
 from utils.log import logger
+from app.utils.cache import minio_object_cache, minio_url_cache
+from app.utils.metrics import add_bytes, timed
 
 
 async def upload_file(
@@ -12,12 +22,18 @@ async def upload_file(
     file_path: str,
     bucket_name: str = BucketName.MUSIC_PLAYLIST.value,
 ):
+    # The MinIO client is blocking, keep it off the event loop
+    return await asyncio.to_thread(_upload_file, file_name, file_path, bucket_name)
+
+
+@timed("minio.upload_file")
+def _upload_file(file_name: str, file_path: str, bucket_name: str):
     if not os.path.isfile(file_path):
         logger.error(f"Error: The file {file_path} does not exist.")
         return False
 
     # Ensure bucket exists
-    if not minio_client.bucket_exists(bucket_name):
+    if not get_minio_client().bucket_exists(bucket_name):
         logger.error(f"Bucket {bucket_name} does not exist.")
         return False
 
@@ -28,13 +44,14 @@ async def upload_file(
     # Open the file in binary mode
     with open(file_path, "rb") as file_data:
         try:
-            minio_client.put_object(
+            get_minio_client().put_object(
                 bucket_name=bucket_name,
                 object_name=file_name,
                 data=file_data,
                 length=file_size,
                 content_type="application/octet-stream",
             )
+            add_bytes("minio.upload_file", file_size)
             logger.info(
                 f"File {file_path} uploaded successfully as {file_name} in bucket {bucket_name}."
             )
@@ -44,25 +61,195 @@ async def upload_file(
             return False
 
 
+@timed("minio.upload")
+def upload_stream(
+    file_name: str,
+    data,
+    length: int = -1,
+    bucket_name: str = BucketName.MUSIC_PLAYLIST.value,
+    part_size: int = minio_part_size,
+    num_parallel_uploads: int = minio_parallel_uploads,
+) -> bool:
+    """
+    Upload a readable stream without staging it on disk. Blocking.
+
+    Parts are read from data as they arrive and sent as a multipart upload
+    with num_parallel_uploads parts in flight. length may be -1 if unknown.
+    """
+    try:
+        get_minio_client().put_object(
+            bucket_name=bucket_name,
+            object_name=file_name,
+            data=data,
+            length=length,
+            content_type="application/octet-stream",
+            part_size=part_size,
+            num_parallel_uploads=num_parallel_uploads,
+        )
+        add_bytes("minio.upload", max(length, 0))
+        # once per song, the download log already reports it
+        logger.debug(
+            "Stream uploaded successfully as {} in bucket {}.", file_name, bucket_name
+        )
+        return True
+    except S3Error as e:
+        logger.error(f"Failed to upload stream {file_name} to MinIO: {e}")
+        return False
+
+
 def presign_upload(filename: str, bucket_name: str = BucketName.MUSIC_PLAYLIST.value):
-    url = minio_client.presigned_put_object(bucket_name, filename)
+    url = get_minio_client().presigned_put_object(bucket_name, filename)
     return url
 
 
 def presign_download(filename: str, bucket_name: str = BucketName.MUSIC_PLAYLIST.value):
     try:
-        url = minio_client.presigned_get_object(bucket_name, filename)
+        url = get_minio_client().presigned_get_object(bucket_name, filename)
 
         return url
     except S3Error:
         return None
 
 
+@timed("minio.stat")
 def file_exists(
     filename: str, bucket_name: str = BucketName.MUSIC_PLAYLIST.value
 ) -> bool:
     try:
-        minio_client.stat_object(bucket_name, filename)
+        get_minio_client().stat_object(bucket_name, filename)
         return True
     except S3Error:
         return False
+
+
+@timed("minio.list")
+def presign_songs_download(
+    song_ids: list,
+    bucket_name: str = BucketName.MUSIC_PLAYLIST.value,
+    max_keys: int = minio_list_max_keys,
+    max_stats: int = minio_stat_concurrency,
+) -> dict:
+    """
+    Look up a batch of songs in one bucket listing instead of a stat_object
+    round trip per song.
+
+    Keys are listed in string order from the smallest wanted name to the
+    largest, which for sparse ids can cover most of the bucket. The listing
+    stops after max_keys keys, and the names it did not reach are checked
+    with stat_object calls, max_stats at a time.
+
+    Returns {song_id: presigned_url} for every song whose object exists.
+    Urls presigned recently are served from minio_url_cache.
+    """
+    urls = {}
+    uncached = []
+    for song_id in song_ids:
+        url = minio_url_cache.get((bucket_name, song_id))
+        if url:
+            urls[song_id] = url
+        else:
+            uncached.append(song_id)
+    if not uncached:
+        return urls
+    wanted = {f"{song_id}.mp3": song_id for song_id in uncached}
+    first, last = min(wanted), max(wanted)
+
+    minio_client = get_minio_client()
+
+    def found(name: str):
+        song_id = wanted[name]
+        # Presigning is a local signature, no request is made
+        urls[song_id] = minio_client.presigned_get_object(bucket_name, name)
+        minio_url_cache.set((bucket_name, song_id), urls[song_id])
+
+    # Every wanted name up to listed_to has been listed, None for none yet
+    listed_to = None
+    try:
+        # Listing is ordered by key and start_after is exclusive, so start
+        # from a prefix of the smallest wanted name and stop past the largest
+        objects = minio_client.list_objects(
+            bucket_name,
+            prefix=os.path.commonprefix([first, last]),
+            start_after=first[:-1],
+        )
+        for scanned, obj in enumerate(objects, 1):
+            if obj.object_name > last:
+                listed_to = last
+                break
+            if obj.object_name in wanted:
+                found(obj.object_name)
+            listed_to = obj.object_name
+            if scanned >= max_keys:
+                break
+        else:
+            listed_to = last
+    except S3Error as e:
+        logger.error(f"Failed to list bucket {bucket_name}: {e}")
+        return urls
+
+    rest = [name for name in wanted if listed_to is None or name > listed_to]
+    # Sparse ids, stat the rest instead of listing the whole bucket
+    for name in existing_objects(rest, bucket_name, max_stats):
+        found(name)
+    return urls
+
+
+def existing_objects(
+    filenames: list,
+    bucket_name: str = BucketName.MUSIC_PLAYLIST.value,
+    max_stats: int = minio_stat_concurrency,
+) -> set:
+    """
+    Which objects exist, with stat_object calls max_stats at a time.
+    Objects found recently are served from minio_object_cache.
+    """
+    found = {name for name in filenames if minio_object_cache.get((bucket_name, name))}
+    rest = [name for name in filenames if name not in found]
+    if rest:
+        with ThreadPoolExecutor(min(max_stats, len(rest))) as pool:
+            exists = pool.map(lambda name: file_exists(name, bucket_name), rest)
+            for name, ok in zip(rest, exists):
+                if ok:
+                    minio_object_cache.set((bucket_name, name), True)
+                    found.add(name)
+    return found
+
+
+@timed("minio.remove")
+def remove_file(filename: str, bucket_name: str = BucketName.MUSIC_PLAYLIST.value):
+    try:
+        get_minio_client().remove_object(bucket_name, filename)
+        return True
+    except S3Error as e:
+        logger.error(f"Failed to remove {filename} from MinIO: {e}")
+        return False
+
+
+def content_object_name(md5: str, format: str) -> str:
+    """Object name of content-addressed audio, shared by every song with it"""
+    return f"audio/{md5}.{format}"
+
+
+def presign_downloads(
+    filenames: list, bucket_name: str = BucketName.MUSIC_PLAYLIST.value
+) -> dict:
+    """Presign many objects known to exist, returns {filename: url}"""
+    minio_client = get_minio_client()
+    return {
+        filename: minio_client.presigned_get_object(bucket_name, filename)
+        for filename in filenames
+    }
+
+
+@timed("minio.get")
+def open_object(filename: str, bucket_name: str = BucketName.MUSIC_PLAYLIST.value):
+    """
+    Streaming response for an object, None if it does not exist. The body
+    is read as it arrives, close() and release_conn() it when done.
+    """
+    try:
+        return get_minio_client().get_object(bucket_name, filename)
+    except S3Error as e:
+        if e.code != "NoSuchKey":
+            logger.error(f"Failed to get {filename} from MinIO: {e}")
+        return None
@@ -0,0 +1,50 @@
+import asyncio
+from weakref import WeakKeyDictionary
+
+from pymongo import AsyncMongoClient
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.asynchronous.database import AsyncDatabase
+
+from app.constants.env import mongo_db_host, mongo_max_pool_size, mongo_min_pool_size
+from .client import DB_NAME
+
+# An AsyncMongoClient belongs to the event loop it was created on, keep one
+# per loop so repeated asyncio.run calls each get a working client
+_clients: WeakKeyDictionary = WeakKeyDictionary()
+
+
+def get_async_client() -> AsyncMongoClient:
+    # Connect on first use in this loop instead of at import
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = AsyncMongoClient(
+            mongo_db_host,
+            maxPoolSize=mongo_max_pool_size,
+            minPoolSize=mongo_min_pool_size,
+        )
+        _clients[loop] = client
+    return client
+
+
+async def close_async_client():
+    """Close the client of the running loop, call before the loop ends"""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
+
+
+def get_async_db() -> AsyncDatabase:
+    return get_async_client()[DB_NAME]
+
+
+def get_async_playlist_collection() -> AsyncCollection:
+    return get_async_db()["playlist"]
+
+
+def get_async_song_collection() -> AsyncCollection:
+    return get_async_db()["song"]
+
+
+def get_async_lyric_collection() -> AsyncCollection:
+    return get_async_db()["lyric"]
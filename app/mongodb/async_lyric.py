@@ -0,0 +1,124 @@
+from typing import Optional
+
+from pymongo.errors import BulkWriteError
+
+from app.utils.metrics import timed
+from .async_client import get_async_lyric_collection, get_async_song_collection
+from .bulk import _duplicate_key_ops
+from .lyric import (
+    LYRIC_PROJECTION,
+    chunks,
+    decompress,
+    set_lyric_ops,
+    set_rendered_ops,
+)
+
+# Async twin of lyric.py, same functions and results, for the event loop
+
+
+@timed("mongo.get_lyric")
+async def get_lyric(song_id) -> Optional[str]:
+    """Stored lyric of a song, None if it has not been fetched yet"""
+    return (await get_lyrics([song_id])).get(song_id)
+
+
+@timed("mongo.get_lyrics")
+async def get_lyrics(song_ids, chunk_size: int = 1000) -> dict:
+    """
+    Stored lyrics of many songs with one $in query per chunk of ids.
+    Returns {song_id: lyric} of the songs whose lyric has been fetched,
+    which may be empty for songs without one.
+    """
+    lyrics = {}
+    for chunk in chunks(song_ids, chunk_size):
+        cursor = get_async_lyric_collection().find(
+            {"id": {"$in": chunk}}, LYRIC_PROJECTION
+        )
+        async for doc in cursor:
+            lyrics[doc["id"]] = decompress(doc["lrc"])
+    missing_ids = [song_id for song_id in song_ids if song_id not in lyrics]
+    if missing_ids:
+        lyrics.update(await _move_song_lyrics(missing_ids, chunk_size))
+    return lyrics
+
+
+@timed("mongo.set_lyric")
+async def set_lyric(song_id, lyric: str) -> bool:
+    """Store a lyric, returns whether it changed"""
+    return await set_lyrics({song_id: lyric}) > 0
+
+
+@timed("mongo.set_lyrics")
+async def set_lyrics(lyrics: dict) -> int:
+    """
+    Store {song_id: lyric} with one bulk write. Lyrics identical to the
+    stored ones are skipped and keep their renders. Returns how many
+    changed.
+    """
+    if not lyrics:
+        return 0
+    cursor = get_async_lyric_collection().find(
+        {"id": {"$in": list(lyrics)}}, {"_id": 0, "id": 1, "hash": 1}
+    )
+    ops = set_lyric_ops(lyrics, {doc["id"]: doc["hash"] async for doc in cursor})
+    if ops:
+        try:
+            await get_async_lyric_collection().bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            await get_async_lyric_collection().bulk_write(
+                _duplicate_key_ops(ops, e), ordered=False
+            )
+    return len(ops)
+
+
+@timed("mongo.get_rendered")
+async def get_rendered(
+    song_ids, format: str, version: int, chunk_size: int = 1000
+) -> dict:
+    """
+    Cached renders of many songs' lyrics in format, made by renderer
+    version. Returns {song_id: text} of the songs that have one.
+    """
+    rendered = {}
+    field = f"renders.{format}"
+    for chunk in chunks(song_ids, chunk_size):
+        cursor = get_async_lyric_collection().find(
+            {"id": {"$in": chunk}, f"{field}.version": version},
+            {"_id": 0, "id": 1, f"{field}.data": 1},
+        )
+        async for doc in cursor:
+            rendered[doc["id"]] = decompress(doc["renders"][format]["data"])
+    return rendered
+
+
+@timed("mongo.set_rendered")
+async def set_rendered(renders: dict, format: str, version: int) -> int:
+    """
+    Cache {song_id: (lyric_hash, text)} renders with one bulk write. A
+    render is only kept if the lyric it was made from is still the stored
+    one. Returns how many were stored.
+    """
+    if not renders:
+        return 0
+    result = await get_async_lyric_collection().bulk_write(
+        set_rendered_ops(renders, format, version), ordered=False
+    )
+    return result.modified_count
+
+
+async def _move_song_lyrics(song_ids: list, chunk_size: int) -> dict:
+    """Move lyrics still stored in song documents into the lyric collection"""
+    lyrics = {}
+    for chunk in chunks(song_ids, chunk_size):
+        cursor = get_async_song_collection().find(
+            {"id": {"$in": chunk}, "lyric": {"$exists": True}},
+            {"_id": 0, "id": 1, "lyric": 1},
+        )
+        async for doc in cursor:
+            lyrics[doc["id"]] = doc["lyric"]
+    if lyrics:
+        await set_lyrics(lyrics)
+        await get_async_song_collection().update_many(
+            {"id": {"$in": list(lyrics)}}, {"$unset": {"lyric": ""}}
+        )
+    return lyrics
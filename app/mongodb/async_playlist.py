@@ -0,0 +1,44 @@
+from typing import Optional
+
+from app.utils.metrics import timed
+from .async_client import get_async_playlist_collection
+from .bulk import bulk_upsert_async
+from .records import PLAYLIST_PROJECTION, Playlist
+from pymongo.results import InsertOneResult, UpdateResult
+
+# Async twin of playlist.py, same functions and results, for the event loop
+
+
+@timed("mongo.insert_playlist")
+async def insert_playlist(playlist: dict) -> InsertOneResult:
+    return await get_async_playlist_collection().insert_one(playlist)
+
+
+@timed("mongo.upsert_playlists")
+async def upsert_playlists(playlists: list[dict]) -> dict:
+    """Insert or update playlists by id, see bulk_upsert for the returned counts"""
+    return await bulk_upsert_async(get_async_playlist_collection(), playlists)
+
+
+@timed("mongo.get_playlist")
+async def get_playlist(id) -> Optional[Playlist]:
+    doc = await get_async_playlist_collection().find_one(
+        {"id": id}, PLAYLIST_PROJECTION
+    )
+    return Playlist.from_doc(doc) if doc else None
+
+
+@timed("mongo.get_removed_track_ids")
+async def get_removed_track_ids(id) -> list:
+    """Tracks that were once in the playlist and have been removed"""
+    doc = await get_async_playlist_collection().find_one(
+        {"id": id}, {"_id": 0, "removed_track_ids": 1}
+    )
+    return doc.get("removed_track_ids", []) if doc else []
+
+
+@timed("mongo.update_playlist")
+async def update_playlist(playlist: dict) -> UpdateResult:
+    return await get_async_playlist_collection().update_one(
+        {"id": playlist["id"]}, {"$set": playlist}
+    )
@@ -0,0 +1,81 @@
+from typing import Optional
+
+from app.utils.cache import song_cache
+from app.utils.metrics import timed
+from .async_client import get_async_song_collection
+from .bulk import bulk_upsert_async
+from .records import SONG_PROJECTION, Song
+
+# Async twin of song.py, same functions and results, for the event loop
+
+
+@timed("mongo.insert_song")
+async def insert_song(song: dict):
+    return await get_async_song_collection().insert_one(song)
+
+
+@timed("mongo.insert_songs")
+async def insert_songs(songs: list[dict]):
+    return await get_async_song_collection().insert_many(songs)
+
+
+@timed("mongo.upsert_songs")
+async def upsert_songs(songs: list[dict]) -> dict:
+    """Insert or update songs by id, see bulk_upsert for the returned counts"""
+    counts = await bulk_upsert_async(get_async_song_collection(), songs)
+    song_cache.invalidate_many(song["id"] for song in songs)
+    return counts
+
+
+@timed("mongo.get_song")
+async def get_song(song_id) -> Optional[Song]:
+    """Song without its lyric, None if it is not in the db"""
+    doc = await get_async_song_collection().find_one({"id": song_id}, SONG_PROJECTION)
+    return Song.from_doc(doc) if doc else None
+
+
+@timed("mongo.get_songs")
+async def get_songs(song_ids, chunk_size: int = 1000) -> tuple[list[Song], list]:
+    """
+    Fetch many songs without lyrics with one $in query per chunk of ids.
+
+    Returns the songs found, in the order of song_ids, and the ids that
+    are not in the db.
+    """
+    found = {}
+    for i in range(0, len(song_ids), chunk_size):
+        chunk = list(song_ids[i : i + chunk_size])
+        cursor = get_async_song_collection().find(
+            {"id": {"$in": chunk}}, SONG_PROJECTION
+        )
+        async for doc in cursor:
+            found[doc["id"]] = Song.from_doc(doc)
+    songs = [found[song_id] for song_id in song_ids if song_id in found]
+    missing_ids = [song_id for song_id in song_ids if song_id not in found]
+    return songs, missing_ids
+
+
+@timed("mongo.find_audio")
+async def find_audio(md5s: list) -> dict:
+    """
+    Audio already stored for any of the md5 digests, with one $in query.
+    Returns {md5: audio} where audio is the song's audio metadata.
+    """
+    if not md5s:
+        return {}
+    audio = {}
+    cursor = get_async_song_collection().find(
+        {"audio.md5": {"$in": list(set(md5s))}}, {"_id": 0, "audio": 1}
+    )
+    async for song in cursor:
+        audio[song["audio"]["md5"]] = song["audio"]
+    return audio
+
+
+@timed("mongo.update_song")
+async def update_song(song: dict):
+    result = await get_async_song_collection().update_one(
+        {"id": song["id"]}, {"$set": song}
+    )
+    song_cache.invalidate(song["id"])
+    return result
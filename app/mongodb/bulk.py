@@ -0,0 +1,83 @@
+from typing import TYPE_CHECKING
+
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+
+if TYPE_CHECKING:
+    from pymongo.asynchronous.collection import AsyncCollection
+
+DUPLICATE_KEY = 11000
+
+
+def bulk_upsert(collection: Collection, docs: list[dict], key: str = "id") -> dict:
+    """
+    Idempotently upsert docs matched on key with one unordered bulk_write.
+
+    Concurrent writers racing on the same key can make an upsert fail with a
+    duplicate key error, those operations are retried once as plain updates.
+
+    Returns counts of inserted, updated and unchanged documents.
+    """
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+    if not docs:
+        return counts
+
+    ops = _upsert_ops(docs, key)
+    try:
+        result = collection.bulk_write(ops, ordered=False)
+        _add_counts(counts, result.bulk_api_result)
+    except BulkWriteError as e:
+        _add_counts(counts, e.details)
+        # The racing writer created the documents, this pass now matches them
+        result = collection.bulk_write(_duplicate_key_ops(ops, e), ordered=False)
+        _add_counts(counts, result.bulk_api_result)
+    return counts
+
+
+async def bulk_upsert_async(
+    collection: "AsyncCollection", docs: list[dict], key: str = "id"
+) -> dict:
+    """Async bulk_upsert for an AsyncCollection"""
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+    if not docs:
+        return counts
+
+    ops = _upsert_ops(docs, key)
+    try:
+        result = await collection.bulk_write(ops, ordered=False)
+        _add_counts(counts, result.bulk_api_result)
+    except BulkWriteError as e:
+        _add_counts(counts, e.details)
+        result = await collection.bulk_write(_duplicate_key_ops(ops, e), ordered=False)
+        _add_counts(counts, result.bulk_api_result)
+    return counts
+
+
+def _upsert_ops(docs: list[dict], key: str) -> list[UpdateOne]:
+    return [
+        UpdateOne(
+            {key: doc[key]},
+            {"$set": {k: v for k, v in doc.items() if k != "_id"}},
+            upsert=True,
+        )
+        for doc in docs
+    ]
+
+
+def _duplicate_key_ops(ops: list[UpdateOne], error: BulkWriteError) -> list:
+    """Operations that failed on a duplicate key, re-raises any other error"""
+    retry = [
+        ops[write_error["index"]]
+        for write_error in error.details["writeErrors"]
+        if write_error["code"] == DUPLICATE_KEY
+    ]
+    if len(retry) < len(error.details["writeErrors"]):
+        raise error
+    return retry
+
+
+def _add_counts(counts: dict, result: dict):
+    counts["inserted"] += result["nUpserted"]
+    counts["updated"] += result["nModified"]
+    counts["unchanged"] += result["nMatched"] - result["nModified"]
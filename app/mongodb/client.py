@@ -1,11 +1,61 @@
+from functools import cache
+
 from pymongo import MongoClient
-from app.constants.env import mongo_db_host
+from pymongo.collection import Collection
+from pymongo.database import Database
+from app.constants.env import (
+    job_done_ttl,
+    mongo_db_host,
+    mongo_db_name,
+    mongo_max_pool_size,
+    mongo_min_pool_size,
+)
+
+DB_NAME = mongo_db_name
+
+
+@cache
+def get_client() -> MongoClient:
+    # Connect to MongoDB on first use instead of at import
+    return MongoClient(
+        mongo_db_host, maxPoolSize=mongo_max_pool_size, minPoolSize=mongo_min_pool_size
+    )
+
+
+def get_db() -> Database:
+    # Access a specific database and collection
+    return get_client()[DB_NAME]
+
+
+def get_playlist_collection() -> Collection:
+    return get_db()["playlist"]
+
+
+def get_song_collection() -> Collection:
+    return get_db()["song"]
+
+
+def get_job_collection() -> Collection:
+    return get_db()["job"]
+
 
-# Connect to MongoDB
-client = MongoClient(mongo_db_host)
+def get_lyric_collection() -> Collection:
+    return get_db()["lyric"]
 
-# Access a specific database and collection
-db = client["music-playlist"]
 
-playlist_collection = db["playlist"]
-song_collection = db["song"]
+def ensure_indexes():
+    """Create the indexes every collection relies on, call once at startup"""
+    get_playlist_collection().create_index("id", unique=True)
+    get_song_collection().create_index("id", unique=True)
+    get_lyric_collection().create_index("id", unique=True)
+    # content-addressed audio lookup for dedup
+    get_song_collection().create_index("audio.md5")
+    # claiming picks the oldest runnable job, queued or with an expired lease
+    get_job_collection().create_index([("status", 1), ("run_at", 1)])
+    get_job_collection().create_index([("status", 1), ("lease_until", 1)])
+    # done jobs expire, dead ones stay until retried
+    get_job_collection().create_index(
+        "finished_at",
+        expireAfterSeconds=job_done_ttl,
+        partialFilterExpression={"status": "done"},
+    )
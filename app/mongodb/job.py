@@ -0,0 +1,155 @@
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from app.constants.env import job_lease_seconds, job_max_attempts, job_retry_backoff
+from app.utils.metrics import timed
+from .client import get_job_collection
+
+# queued -> running -> done, or back to queued until max_attempts, then dead
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+DEAD = "dead"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def job_record(
+    kind: str,
+    payload: dict,
+    max_attempts: int = job_max_attempts,
+    run_at: Optional[datetime] = None,
+) -> dict:
+    now = _now()
+    return {
+        "kind": kind,
+        "payload": payload,
+        "status": QUEUED,
+        "attempts": 0,
+        "max_attempts": max_attempts,
+        "run_at": run_at or now,
+        "created_at": now,
+        "worker": None,
+        "lease_until": None,
+        "error": None,
+    }
+
+
+@timed("mongo.enqueue_jobs")
+def enqueue_jobs(jobs: list[dict]) -> list[ObjectId]:
+    """Insert jobs built with job_record, returns their ids"""
+    if not jobs:
+        return []
+    return get_job_collection().insert_many(jobs, ordered=False).inserted_ids
+
+
+def enqueue_job(kind: str, payload: dict, **kwargs) -> ObjectId:
+    return enqueue_jobs([job_record(kind, payload, **kwargs)])[0]
+
+
+@timed("mongo.claim_job")
+def claim_job(worker: str, lease: float = job_lease_seconds) -> Optional[dict]:
+    """
+    Atomically lease the oldest runnable job to worker.
+
+    A job is runnable when it is queued and due, or when it is running but
+    its lease has expired because the worker holding it died or stalled.
+    """
+    now = _now()
+    return get_job_collection().find_one_and_update(
+        {
+            "$or": [
+                {"status": QUEUED, "run_at": {"$lte": now}},
+                {"status": RUNNING, "lease_until": {"$lt": now}},
+            ]
+        },
+        {
+            "$set": {
+                "status": RUNNING,
+                "worker": worker,
+                "lease_until": now + timedelta(seconds=lease),
+                "started_at": now,
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("run_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+@timed("mongo.heartbeat")
+def heartbeat(job_id: ObjectId, worker: str, lease: float = job_lease_seconds) -> bool:
+    """Extend the lease on a job, False if worker no longer holds it"""
+    result = get_job_collection().update_one(
+        {"_id": job_id, "status": RUNNING, "worker": worker},
+        {"$set": {"lease_until": _now() + timedelta(seconds=lease)}},
+    )
+    return result.matched_count == 1
+
+
+@timed("mongo.complete_job")
+def complete_job(job_id: ObjectId, worker: str, result=None) -> bool:
+    update = get_job_collection().update_one(
+        {"_id": job_id, "status": RUNNING, "worker": worker},
+        {
+            "$set": {
+                "status": DONE,
+                "result": result,
+                "finished_at": _now(),
+                "lease_until": None,
+                "error": None,
+            }
+        },
+    )
+    return update.matched_count == 1
+
+
+@timed("mongo.fail_job")
+def fail_job(job: dict, worker: str, error: str, retry: bool = True) -> str:
+    """
+    Requeue a failed job with exponential backoff, or dead-letter it once
+    it has used up its attempts, or right away without retry. Returns the
+    new status.
+    """
+    attempts = job["attempts"]
+    if not retry or attempts >= job.get("max_attempts", job_max_attempts):
+        status = DEAD
+        update = {"status": DEAD, "finished_at": _now()}
+    else:
+        status = QUEUED
+        delay = job_retry_backoff * 2 ** (attempts - 1)
+        update = {"status": QUEUED, "run_at": _now() + timedelta(seconds=delay)}
+    update.update({"error": error, "lease_until": None})
+    get_job_collection().update_one(
+        {"_id": job["_id"], "status": RUNNING, "worker": worker}, {"$set": update}
+    )
+    return status
+
+
+@timed("mongo.retry_dead_jobs")
+def retry_dead_jobs(kind: Optional[str] = None) -> int:
+    """Put dead-lettered jobs back in the queue with fresh attempts"""
+    query = {"status": DEAD}
+    if kind:
+        query["kind"] = kind
+    result = get_job_collection().update_many(
+        query,
+        {"$set": {"status": QUEUED, "attempts": 0, "run_at": _now(), "error": None}},
+    )
+    return result.modified_count
+
+
+@timed("mongo.job_counts")
+def job_counts() -> dict:
+    """Number of jobs per status"""
+    counts = {QUEUED: 0, RUNNING: 0, DONE: 0, DEAD: 0}
+    for row in get_job_collection().aggregate(
+        [{"$group": {"_id": "$status", "count": {"$sum": 1}}}]
+    ):
+        counts[row["_id"]] = row["count"]
+    return counts
@@ -0,0 +1,181 @@
+import hashlib
+import zlib
+from datetime import datetime, timezone
+from typing import Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.utils.metrics import timed
+from .bulk import _duplicate_key_ops
+from .client import get_lyric_collection, get_song_collection
+
+# Lyrics have their own collection, one document per song:
+#   id, hash (sha1 of the lyric), version (bumped when it changes), size,
+#   lrc (zlib compressed lyric), updated_at and
+#   renders: {format: {"version": renderer version, "data": compressed}}
+# renders caches the lyric rendered to other formats such as srt, and is
+# dropped whenever the lyric changes. Older versions kept the lyric in the
+# song document, it is moved here the first time it is read.
+
+LYRIC_PROJECTION = {"_id": 0, "id": 1, "lrc": 1}
+
+
+def lyric_hash(lyric: str) -> str:
+    return hashlib.sha1(lyric.encode("utf-8")).hexdigest()
+
+
+def compress(text: str) -> bytes:
+    return zlib.compress(text.encode("utf-8"))
+
+
+def decompress(data: bytes) -> str:
+    return zlib.decompress(data).decode("utf-8")
+
+
+def chunks(ids, chunk_size: int) -> list[list]:
+    return [list(ids[i : i + chunk_size]) for i in range(0, len(ids), chunk_size)]
+
+
+@timed("mongo.get_lyric")
+def get_lyric(song_id) -> Optional[str]:
+    """Stored lyric of a song, None if it has not been fetched yet"""
+    return get_lyrics([song_id]).get(song_id)
+
+
+@timed("mongo.get_lyrics")
+def get_lyrics(song_ids, chunk_size: int = 1000) -> dict:
+    """
+    Stored lyrics of many songs with one $in query per chunk of ids.
+    Returns {song_id: lyric} of the songs whose lyric has been fetched,
+    which may be empty for songs without one.
+    """
+    lyrics = {}
+    for chunk in chunks(song_ids, chunk_size):
+        for doc in get_lyric_collection().find(
+            {"id": {"$in": chunk}}, LYRIC_PROJECTION
+        ):
+            lyrics[doc["id"]] = decompress(doc["lrc"])
+    missing_ids = [song_id for song_id in song_ids if song_id not in lyrics]
+    if missing_ids:
+        lyrics.update(_move_song_lyrics(missing_ids, chunk_size))
+    return lyrics
+
+
+@timed("mongo.set_lyric")
+def set_lyric(song_id, lyric: str) -> bool:
+    """Store a lyric, returns whether it changed"""
+    return set_lyrics({song_id: lyric}) > 0
+
+
+@timed("mongo.set_lyrics")
+def set_lyrics(lyrics: dict) -> int:
+    """
+    Store {song_id: lyric} with one bulk write. Lyrics identical to the
+    stored ones are skipped and keep their renders. Returns how many
+    changed.
+    """
+    if not lyrics:
+        return 0
+    hashes = get_lyric_collection().find(
+        {"id": {"$in": list(lyrics)}}, {"_id": 0, "id": 1, "hash": 1}
+    )
+    ops = set_lyric_ops(lyrics, {doc["id"]: doc["hash"] for doc in hashes})
+    if ops:
+        try:
+            get_lyric_collection().bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            # a concurrent writer inserted the same song first
+            get_lyric_collection().bulk_write(_duplicate_key_ops(ops, e), ordered=False)
+    return len(ops)
+
+
+@timed("mongo.get_rendered")
+def get_rendered(song_ids, format: str, version: int, chunk_size: int = 1000) -> dict:
+    """
+    Cached renders of many songs' lyrics in format, made by renderer
+    version. Returns {song_id: text} of the songs that have one.
+    """
+    rendered = {}
+    field = f"renders.{format}"
+    for chunk in chunks(song_ids, chunk_size):
+        docs = get_lyric_collection().find(
+            {"id": {"$in": chunk}, f"{field}.version": version},
+            {"_id": 0, "id": 1, f"{field}.data": 1},
+        )
+        for doc in docs:
+            rendered[doc["id"]] = decompress(doc["renders"][format]["data"])
+    return rendered
+
+
+@timed("mongo.set_rendered")
+def set_rendered(renders: dict, format: str, version: int) -> int:
+    """
+    Cache {song_id: (lyric_hash, text)} renders with one bulk write. A
+    render is only kept if the lyric it was made from is still the stored
+    one. Returns how many were stored.
+    """
+    if not renders:
+        return 0
+    result = get_lyric_collection().bulk_write(
+        set_rendered_ops(renders, format, version), ordered=False
+    )
+    return result.modified_count
+
+
+def set_lyric_ops(lyrics: dict, stored_hashes: dict) -> list[UpdateOne]:
+    ops = []
+    now = datetime.now(timezone.utc)
+    for song_id, lyric in lyrics.items():
+        digest = lyric_hash(lyric)
+        if stored_hashes.get(song_id) == digest:
+            continue
+        ops.append(
+            UpdateOne(
+                {"id": song_id},
+                {
+                    "$set": {
+                        "hash": digest,
+                        "size": len(lyric),
+                        "lrc": compress(lyric),
+                        "updated_at": now,
+                    },
+                    "$inc": {"version": 1},
+                    # renders of the previous lyric are stale
+                    "$unset": {"renders": ""},
+                },
+                upsert=True,
+            )
+        )
+    return ops
+
+
+def set_rendered_ops(renders: dict, format: str, version: int) -> list[UpdateOne]:
+    return [
+        UpdateOne(
+            {"id": song_id, "hash": digest},
+            {
+                "$set": {
+                    f"renders.{format}": {"version": version, "data": compress(text)}
+                }
+            },
+        )
+        for song_id, (digest, text) in renders.items()
+    ]
+
+
+def _move_song_lyrics(song_ids: list, chunk_size: int) -> dict:
+    """Move lyrics still stored in song documents into the lyric collection"""
+    lyrics = {}
+    for chunk in chunks(song_ids, chunk_size):
+        docs = get_song_collection().find(
+            {"id": {"$in": chunk}, "lyric": {"$exists": True}},
+            {"_id": 0, "id": 1, "lyric": 1},
+        )
+        lyrics.update((doc["id"], doc["lyric"]) for doc in docs)
+    if lyrics:
+        set_lyrics(lyrics)
+        get_song_collection().update_many(
+            {"id": {"$in": list(lyrics)}}, {"$unset": {"lyric": ""}}
+        )
+    return lyrics
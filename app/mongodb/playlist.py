@@ -1,20 +1,40 @@
-from .client import playlist_collection
+from typing import Optional
+
+from app.utils.metrics import timed
+from .bulk import bulk_upsert
+from .client import get_playlist_collection
+from .records import PLAYLIST_PROJECTION, Playlist
 from pymongo.results import InsertOneResult, UpdateResult
 
 
+@timed("mongo.insert_playlist")
 def insert_playlist(playlist: dict) -> InsertOneResult:
-    playlist_collection.create_index("id", unique=True)
-    return playlist_collection.insert_one(playlist)
+    return get_playlist_collection().insert_one(playlist)
+
+
+@timed("mongo.upsert_playlists")
+def upsert_playlists(playlists: list[dict]) -> dict:
+    """Insert or update playlists by id, see bulk_upsert for the returned counts"""
+    return bulk_upsert(get_playlist_collection(), playlists)
+
+
+@timed("mongo.get_playlist")
+def get_playlist(id) -> Optional[Playlist]:
+    doc = get_playlist_collection().find_one({"id": id}, PLAYLIST_PROJECTION)
+    return Playlist.from_doc(doc) if doc else None
 
 
-def get_playlist(id: str):
-    playlist = playlist_collection.find_one({"id": id})
-    if playlist:
-        playlist.pop("_id")
-        return playlist
-    else:
-        return None
+@timed("mongo.get_removed_track_ids")
+def get_removed_track_ids(id) -> list:
+    """Tracks that were once in the playlist and have been removed"""
+    doc = get_playlist_collection().find_one(
+        {"id": id}, {"_id": 0, "removed_track_ids": 1}
+    )
+    return doc.get("removed_track_ids", []) if doc else []
 
 
+@timed("mongo.update_playlist")
 def update_playlist(playlist: dict) -> UpdateResult:
-    return playlist_collection.update_one({"id": playlist["id"]}, {"$set": playlist})
+    return get_playlist_collection().update_one(
+        {"id": playlist["id"]}, {"$set": playlist}
+    )
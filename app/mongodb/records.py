@@ -0,0 +1,124 @@
+from array import array
+from dataclasses import dataclass, field
+from typing import Optional
+
+# Fields read for a Song, raw singer/album objects stored by older versions
+# keep many more keys that are never loaded
+SONG_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "name": 1,
+    "singer.id": 1,
+    "singer.name": 1,
+    "album.id": 1,
+    "album.name": 1,
+    "album.picUrl": 1,
+    "audio": 1,
+}
+
+# Every playlist field but sync bookkeeping
+PLAYLIST_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "name": 1,
+    "description": 1,
+    "track_ids": 1,
+    "update_time": 1,
+}
+
+
+def track_id_array(track_ids) -> array:
+    """Track ids packed as int64, 8 bytes each instead of a boxed int"""
+    return array("q", track_ids)
+
+
+@dataclass(slots=True)
+class Song:
+    """
+    Song without its lyric, as held in memory and in song_cache.
+    Lyrics are kept in their own collection, see app.mongodb.lyric.
+    """
+
+    id: int
+    name: str = ""
+    singer_id: int = 0
+    singer_name: str = ""
+    album_id: int = 0
+    album_name: str = ""
+    album_pic_url: str = ""
+    # md5, size, quality, format and object of the audio stored in MinIO
+    audio: Optional[dict] = None
+
+    @classmethod
+    def from_netease(cls, song: dict) -> "Song":
+        """Song from netease song details"""
+        singer = (song.get("ar") or [{}])[0]
+        album = song.get("al") or {}
+        return cls(
+            id=song.get("id", 0),
+            name=song.get("name", ""),
+            singer_id=singer.get("id") or 0,
+            singer_name=singer.get("name") or "",
+            album_id=album.get("id") or 0,
+            album_name=album.get("name") or "",
+            album_pic_url=album.get("picUrl") or "",
+        )
+
+    @classmethod
+    def from_doc(cls, doc: dict) -> "Song":
+        """Song from a mongodb document read with SONG_PROJECTION"""
+        singer = doc.get("singer") or {}
+        album = doc.get("album") or {}
+        return cls(
+            id=doc["id"],
+            name=doc.get("name", ""),
+            singer_id=singer.get("id") or 0,
+            singer_name=singer.get("name") or "",
+            album_id=album.get("id") or 0,
+            album_name=album.get("name") or "",
+            album_pic_url=album.get("picUrl") or "",
+            audio=doc.get("audio"),
+        )
+
+    def to_doc(self) -> dict:
+        """Mongodb document, audio is left out so it is never overwritten"""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "singer": {"id": self.singer_id, "name": self.singer_name},
+            "album": {
+                "id": self.album_id,
+                "name": self.album_name,
+                "picUrl": self.album_pic_url,
+            },
+        }
+
+
+@dataclass(slots=True)
+class Playlist:
+    id: int
+    name: str = ""
+    description: str = ""
+    track_ids: array = field(default_factory=track_id_array)
+    update_time: Optional[int] = None
+    # Filled in by Netease.get_playlist, in the order of track_ids
+    tracks: Optional[list[Song]] = None
+
+    @classmethod
+    def from_doc(cls, doc: dict) -> "Playlist":
+        return cls(
+            id=doc["id"],
+            name=doc.get("name", ""),
+            description=doc.get("description", ""),
+            track_ids=track_id_array(doc.get("track_ids", [])),
+            update_time=doc.get("update_time"),
+        )
+
+    def to_doc(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "description": self.description,
+            "track_ids": self.track_ids.tolist(),
+            "update_time": self.update_time,
+        }
@@ -1,24 +1,74 @@
-from .client import song_collection
+from typing import Optional
 
+from app.utils.cache import song_cache
+from app.utils.metrics import timed
+from .bulk import bulk_upsert
+from .client import get_song_collection
+from .records import SONG_PROJECTION, Song
 
+
+@timed("mongo.insert_song")
 def insert_song(song: dict):
-    song_collection.create_index("id", unique=True)
-    return song_collection.insert_one(song)
+    return get_song_collection().insert_one(song)
 
 
+@timed("mongo.insert_songs")
 def insert_songs(songs: list[dict]):
-    song_collection.create_index("id", unique=True)
-    return song_collection.insert_many(songs)
+    return get_song_collection().insert_many(songs)
+
+
+@timed("mongo.upsert_songs")
+def upsert_songs(songs: list[dict]) -> dict:
+    """Insert or update songs by id, see bulk_upsert for the returned counts"""
+    counts = bulk_upsert(get_song_collection(), songs)
+    song_cache.invalidate_many(song["id"] for song in songs)
+    return counts
+
+
+@timed("mongo.get_song")
+def get_song(song_id) -> Optional[Song]:
+    """Song without its lyric, None if it is not in the db"""
+    doc = get_song_collection().find_one({"id": song_id}, SONG_PROJECTION)
+    return Song.from_doc(doc) if doc else None
+
+
+@timed("mongo.get_songs")
+def get_songs(song_ids, chunk_size: int = 1000) -> tuple[list[Song], list]:
+    """
+    Fetch many songs without lyrics with one $in query per chunk of ids.
+
+    Returns the songs found, in the order of song_ids, and the ids that
+    are not in the db.
+    """
+    found = {}
+    for i in range(0, len(song_ids), chunk_size):
+        chunk = list(song_ids[i : i + chunk_size])
+        for doc in get_song_collection().find({"id": {"$in": chunk}}, SONG_PROJECTION):
+            found[doc["id"]] = Song.from_doc(doc)
+    songs = [found[song_id] for song_id in song_ids if song_id in found]
+    missing_ids = [song_id for song_id in song_ids if song_id not in found]
+    return songs, missing_ids
 
 
-def get_song(song_id: str):
-    song = song_collection.find_one({"id": song_id})
-    if song:
-        song.pop("_id")
-        return song
-    else:
-        return None
+@timed("mongo.find_audio")
+def find_audio(md5s: list) -> dict:
+    """
+    Audio already stored for any of the md5 digests, with one $in query.
+    Returns {md5: audio} where audio is the song's audio metadata.
+    """
+    if not md5s:
+        return {}
+    audio = {}
+    songs = get_song_collection().find(
+        {"audio.md5": {"$in": list(set(md5s))}}, {"_id": 0, "audio": 1}
+    )
+    for song in songs:
+        audio[song["audio"]["md5"]] = song["audio"]
+    return audio
 
 
+@timed("mongo.update_song")
 def update_song(song: dict):
-    return song_collection.update_one({"id": song["id"]}, {"$set": song})
+    result = get_song_collection().update_one({"id": song["id"]}, {"$set": song})
+    song_cache.invalidate(song["id"])
+    return result
@@ -0,0 +1,178 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Hashable
+from weakref import WeakKeyDictionary
+
+from app.constants.env import (
+    netease_rate_limit,
+    netease_rate_burst,
+    song_detail_batch_size,
+    netease_api_concurrency,
+)
+from app.netease.netease_api import NeteaseApi
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter for coroutines, allowing rate calls per second
+    on average with bursts of up to burst calls.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# Shared by every AsyncNeteaseApi in the process so parallel playlist syncs
+# together stay under Netease's rate limits
+rate_limiter = TokenBucket(netease_rate_limit, netease_rate_burst)
+
+
+class AsyncNeteaseApi:
+    """
+    Async twin of NeteaseApi.
+
+    Each weapi call waits for a token from the shared rate limiter, then runs
+    on the NeteaseApi pooled session in a worker thread so the event loop is
+    never blocked. Concurrent calls asking for the same song, lyric, url or
+    playlist share one in-flight request instead of sending their own.
+    """
+
+    def __init__(self, netease_api: NeteaseApi, limiter: TokenBucket = rate_limiter):
+        self.netease_api = netease_api
+        self.limiter = limiter
+        # A semaphore belongs to the event loop it first waits on, keep one
+        # per loop so an instance reused across asyncio.run calls still works
+        self._semaphores: WeakKeyDictionary = WeakKeyDictionary()
+        # (kind, id) -> task fetching a batch that includes id
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+
+    async def get_playlist(self, playlist_id: str):
+        # Paging of very large playlists happens inside this one call
+        results = await self._coalesce(
+            "playlist",
+            [playlist_id],
+            lambda ids: self._fetch_one(self.netease_api.get_playlist, ids[0]),
+        )
+        return results[playlist_id]
+
+    async def get_playlist_page(self, playlist_id, offset: int = 0) -> dict:
+        results = await self._coalesce(
+            ("playlist_page", offset),
+            [playlist_id],
+            lambda ids: self._fetch_one(
+                self.netease_api.get_playlist_page, ids[0], offset
+            ),
+        )
+        return results[playlist_id]
+
+    async def get_playlist_track_ids(self, playlist_id, first_page: dict) -> list:
+        """See NeteaseApi.get_playlist_track_ids, paging happens in one call"""
+        results = await self._coalesce(
+            "playlist_track_ids",
+            [playlist_id],
+            lambda ids: self._fetch_one(
+                self.netease_api.get_playlist_track_ids, ids[0], first_page
+            ),
+        )
+        return results[playlist_id]
+
+    async def get_songs(self, song_ids: list) -> list[dict]:
+        """Song details in the order of song_ids, see NeteaseApi.get_songs"""
+        results = await self._coalesce("song", song_ids, self._fetch_songs)
+        return [results[id] for id in song_ids if id in results]
+
+    async def get_lyric(self, song_id) -> str:
+        results = await self._coalesce(
+            "lyric",
+            [song_id],
+            lambda ids: self._fetch_one(self.netease_api.get_lyric, ids[0]),
+        )
+        return results[song_id]
+
+    async def get_songs_url_with_quality(
+        self, song_ids: list, quality: str = "lossless"
+    ) -> list[dict]:
+        results = await self._coalesce(
+            ("url", quality),
+            song_ids,
+            lambda ids: self._fetch_urls(ids, quality),
+        )
+        return [results[id] for id in song_ids if id in results]
+
+    async def _call(self, fn: Callable, *args):
+        async with self._semaphore():
+            await self.limiter.acquire()
+            return await asyncio.to_thread(fn, *args)
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(netease_api_concurrency)
+            self._semaphores[loop] = semaphore
+        return semaphore
+
+    async def _fetch_one(self, fn: Callable, id, *args) -> dict:
+        return {id: await self._call(fn, id, *args)}
+
+    async def _fetch_songs(self, song_ids: list) -> dict:
+        batches = [
+            song_ids[i : i + song_detail_batch_size]
+            for i in range(0, len(song_ids), song_detail_batch_size)
+        ]
+        results = await asyncio.gather(
+            *(self._call(self.netease_api.get_songs_batch, batch) for batch in batches)
+        )
+        return {song["id"]: song for batch in results for song in batch}
+
+    async def _fetch_urls(self, song_ids: list, quality: str) -> dict:
+        urls = await self._call(
+            self.netease_api.get_songs_url_with_quality, song_ids, quality
+        )
+        return {url["id"]: url for url in urls}
+
+    async def _coalesce(
+        self,
+        kind: Hashable,
+        ids: list,
+        fetch: Callable[[list], Awaitable[dict]],
+    ) -> dict:
+        """
+        Fetch ids with one call to fetch, except those another caller is
+        already fetching, which are taken from that caller's request.
+        fetch takes a list of ids and returns {id: result}.
+        """
+        new_ids = [id for id in dict.fromkeys(ids) if (kind, id) not in self._inflight]
+        if new_ids:
+            task = asyncio.ensure_future(fetch(new_ids))
+            for id in new_ids:
+                self._inflight[(kind, id)] = task
+
+            def done(task):
+                for id in new_ids:
+                    if self._inflight.get((kind, id)) is task:
+                        del self._inflight[(kind, id)]
+
+            task.add_done_callback(done)
+
+        tasks = {self._inflight[(kind, id)] for id in ids}
+        results = {}
+        for task in tasks:
+            # shield so a cancelled caller doesn't cancel a shared request
+            results.update(await asyncio.shield(task))
+        return results
@@ -0,0 +1,462 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.constants.env import (
+    download_concurrency,
+    download_per_host_limit,
+    download_chunk_size,
+    download_max_chunk_size,
+    download_timeout,
+)
+from app.min_io.services import upload_stream, remove_file
+from app.utils.log import SampledLog, logger
+from app.utils.metrics import add_bytes, record, span
+
+# (song_id, bytes_done, total_bytes) - total_bytes is 0 when the server
+# does not send a Content-Length
+ProgressCallback = Callable[[int, int, int], None]
+
+# Bytes between checkpoint writes of a resumable download
+CHECKPOINT_INTERVAL = 4 * 1024 * 1024
+# Leading bytes kept to recognise the audio container
+HEAD_SIZE = 12
+
+
+class DownloadError(Exception):
+    pass
+
+
+@dataclass
+class DownloadTask:
+    song_id: int
+    url: str
+    # Local copy to write, None to skip the disk entirely
+    filename: Optional[Path] = None
+    # MinIO object to stream the response into, None to skip the upload
+    object_name: Optional[str] = None
+    # Expected md5 hex digest and size, checked once the transfer is done
+    md5: Optional[str] = None
+    size: int = 0
+
+
+@dataclass
+class DownloadResult:
+    song_id: int
+    filename: Optional[Path]
+    ok: bool
+    size: int = 0
+    elapsed: float = 0.0
+    error: Optional[str] = None
+    uploaded: bool = False
+    md5: Optional[str] = None
+    # Container sniffed from the first bytes, None if not recognised
+    format: Optional[str] = None
+
+
+class TeeReader:
+    """
+    File-like reader over a streamed response.
+
+    Every chunk pulled from the response is also written to copy_to (if
+    given) so one pass over the network feeds both the upload and the
+    local file, and is added to the md5 of the content. Time spent in
+    copy_to writes is summed in write_seconds.
+    """
+
+    def __init__(
+        self,
+        chunks,
+        copy_to=None,
+        on_chunk: Callable[[int], None] = None,
+        md5=None,
+    ):
+        self._chunks = chunks
+        self._copy_to = copy_to
+        self._on_chunk = on_chunk
+        self.md5 = md5 or hashlib.md5()
+        self.head = b""
+        self._buffer = bytearray()
+        self.bytes_read = 0
+        self.write_seconds = 0.0
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            if not chunk:
+                continue
+            if self._copy_to:
+                start = time.perf_counter()
+                self._copy_to.write(chunk)
+                self.write_seconds += time.perf_counter() - start
+            self.md5.update(chunk)
+            if len(self.head) < HEAD_SIZE:
+                self.head += chunk[: HEAD_SIZE - len(self.head)]
+            self.bytes_read += len(chunk)
+            if self._on_chunk:
+                self._on_chunk(self.bytes_read)
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def drain(self):
+        """Consume the rest of the response"""
+        while self.read(1024 * 1024):
+            pass
+
+
+class Downloader:
+    """
+    Download many files concurrently without blocking the event loop.
+
+    Transfers run in worker threads on a shared pooled session. A global
+    semaphore caps the number of transfers in flight and a per-host semaphore
+    caps how many of them hit the same server.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = download_concurrency,
+        per_host_limit: int = download_per_host_limit,
+        chunk_size: int = download_chunk_size,
+        max_chunk_size: int = download_max_chunk_size,
+        timeout: float = download_timeout,
+    ):
+        self.concurrency = concurrency
+        self.per_host_limit = per_host_limit
+        self.chunk_size = chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._host_semaphores: dict[str, asyncio.Semaphore] = {}
+        self._log = SampledLog("Downloaded songs")
+
+    async def download_all(
+        self,
+        tasks: list[DownloadTask],
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> list[DownloadResult]:
+        """Download every task, returning one result per task in input order"""
+        results = await asyncio.gather(
+            *(self.download(task, on_progress) for task in tasks)
+        )
+        failed = sum(1 for result in results if not result.ok)
+        self._log.summary("{} failed", failed)
+        # the next batch counts from zero
+        self._log = SampledLog("Downloaded songs")
+        return results
+
+    async def download(
+        self, task: DownloadTask, on_progress: Optional[ProgressCallback] = None
+    ) -> DownloadResult:
+        host = urlsplit(task.url).netloc
+        async with self._semaphore, self._host_semaphore(host):
+            loop = asyncio.get_running_loop()
+            progress = None
+            if on_progress:
+
+                def progress(song_id, done, total):
+                    loop.call_soon_threadsafe(on_progress, song_id, done, total)
+
+            start = time.perf_counter()
+            try:
+                # to_thread carries the span, stages of the transfer join it
+                with span("download", song_id=task.song_id):
+                    size, md5, head = await asyncio.to_thread(
+                        self._fetch, task, progress
+                    )
+            except (requests.RequestException, OSError, DownloadError) as e:
+                logger.error(f"Failed to download song {task.song_id}: {e}")
+                return DownloadResult(
+                    task.song_id,
+                    task.filename,
+                    ok=False,
+                    elapsed=time.perf_counter() - start,
+                    error=str(e),
+                )
+            elapsed = time.perf_counter() - start
+            add_bytes("download", size)
+            self._log.item(
+                "Downloaded song {} to {} ({} bytes in {:.2f}s)",
+                task.song_id,
+                task.filename or task.object_name,
+                size,
+                elapsed,
+            )
+            return DownloadResult(
+                task.song_id,
+                task.filename,
+                ok=True,
+                size=size,
+                elapsed=elapsed,
+                uploaded=task.object_name is not None,
+                md5=md5,
+                format=sniff_format(head),
+            )
+
+    def close(self):
+        self.session.close()
+
+    def _host_semaphore(self, host: str) -> asyncio.Semaphore:
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.per_host_limit)
+        return self._host_semaphores[host]
+
+    def _chunk_size_for(self, total: int) -> int:
+        """Scale the read size with the file so big files need fewer syscalls"""
+        if not total:
+            return self.chunk_size
+        return max(self.chunk_size, min(self.max_chunk_size, total // 64))
+
+    def _fetch(
+        self, task: DownloadTask, progress: Optional[ProgressCallback]
+    ) -> tuple[int, str, bytes]:
+        """
+        Blocking transfer of a single file, run in a worker thread.
+        Returns the size, md5 hex digest and first bytes of the file.
+        """
+        if task.filename is None:
+            return self._stream_to_minio(task, progress)
+        return self._fetch_resumable(task, progress)
+
+    def _stream_to_minio(
+        self, task: DownloadTask, progress: Optional[ProgressCallback]
+    ) -> tuple[int, str, bytes]:
+        with self.session.get(task.url, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            total = int(response.headers.get("Content-Length", 0))
+            chunks = response.iter_content(self._chunk_size_for(total))
+            reader = TeeReader(chunks, on_chunk=self._on_chunk(task, progress, total))
+            self._upload(task, reader, total)
+        md5 = reader.md5.hexdigest()
+        error = self._verify(task, reader.bytes_read, md5)
+        if error:
+            remove_file(task.object_name)
+            raise DownloadError(error)
+        return reader.bytes_read, md5, reader.head
+
+    def _fetch_resumable(
+        self, task: DownloadTask, progress: Optional[ProgressCallback]
+    ) -> tuple[int, str, bytes]:
+        """
+        Download into a .part file next to task.filename, resuming from
+        where a previous attempt stopped when its checkpoint is still there.
+        """
+        part = task.filename.with_name(task.filename.name + ".part")
+        checkpoint = Checkpoint.load(part)
+        offset = part.stat().st_size if checkpoint and part.exists() else 0
+        md5 = hashlib.md5()
+        head = b""
+        headers = {}
+        if offset:
+            # The md5 covers the whole file, start with what is already there
+            head = _hash_file(part, md5)
+            headers["Range"] = f"bytes={offset}-"
+            if checkpoint.validator:
+                # Only honour the range if the file has not changed since
+                headers["If-Range"] = checkpoint.validator
+        task.filename.parent.mkdir(parents=True, exist_ok=True)
+
+        uploaded = False
+        response = self.session.get(
+            task.url, stream=True, timeout=self.timeout, headers=headers
+        )
+        if response.status_code == 416 and offset and offset != checkpoint.size:
+            # The checkpoint no longer matches the file, start over
+            response.close()
+            part.unlink(missing_ok=True)
+            checkpoint.remove()
+            offset = 0
+            response = self.session.get(task.url, stream=True, timeout=self.timeout)
+        with response:
+            if response.status_code == 416 and offset:
+                # The previous attempt got every byte but stopped before finishing
+                total = done = offset
+            else:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    offset = 0
+                    md5 = hashlib.md5()
+                    head = b""
+                total = _total_size(response, offset)
+                if offset:
+                    logger.info(
+                        "Resuming song {} at {} of {} bytes",
+                        task.song_id,
+                        offset,
+                        total,
+                    )
+                checkpoint = Checkpoint(
+                    part,
+                    size=total,
+                    done=offset,
+                    validator=response.headers.get("ETag")
+                    or response.headers.get("Last-Modified"),
+                )
+                checkpoint.save()
+
+                chunks = response.iter_content(self._chunk_size_for(total))
+                with open(part, "ab" if offset else "wb") as f:
+                    on_progress = self._on_chunk(task, progress, total, offset)
+
+                    def on_chunk(read):
+                        if on_progress:
+                            on_progress(read)
+                        if offset + read - checkpoint.done >= CHECKPOINT_INTERVAL:
+                            f.flush()
+                            checkpoint.done = offset + read
+                            checkpoint.save()
+
+                    reader = TeeReader(chunks, f, on_chunk, md5)
+                    reader.head = head
+                    if task.object_name and not offset:
+                        # Fresh download, tee it into MinIO on the way through
+                        self._upload(task, reader, total)
+                        uploaded = True
+                    else:
+                        reader.drain()
+                done = offset + reader.bytes_read
+                head = reader.head
+                record("disk.write", reader.write_seconds)
+                add_bytes("disk.write", reader.bytes_read)
+
+        if total and done != total:
+            if done > total:
+                # More bytes than announced, the partial file can't be trusted
+                part.unlink(missing_ok=True)
+                checkpoint.remove()
+            else:
+                checkpoint.done = done
+                checkpoint.save()
+            raise DownloadError(f"expected {total} bytes, got {done}")
+        error = self._verify(task, done, md5.hexdigest())
+        if error:
+            part.unlink(missing_ok=True)
+            checkpoint.remove()
+            if uploaded:
+                remove_file(task.object_name)
+            raise DownloadError(error)
+        os.replace(part, task.filename)
+        checkpoint.remove()
+
+        if task.object_name and not uploaded:
+            with open(task.filename, "rb") as f:
+                self._upload(task, f, done)
+        return done, md5.hexdigest(), head
+
+    def _upload(self, task: DownloadTask, data, total: int):
+        if not upload_stream(task.object_name, data, total or -1):
+            raise DownloadError(f"upload of {task.object_name} failed")
+
+    @staticmethod
+    def _verify(task: DownloadTask, size: int, md5: str) -> Optional[str]:
+        """Describe how the file differs from what was expected, if it does"""
+        if task.size and size != task.size:
+            return f"expected {task.size} bytes, got {size}"
+        if task.md5 and md5 != task.md5.lower():
+            return f"expected md5 {task.md5}, got {md5}"
+        return None
+
+    @staticmethod
+    def _on_chunk(
+        task: DownloadTask,
+        progress: Optional[ProgressCallback],
+        total: int,
+        offset: int = 0,
+    ) -> Optional[Callable[[int], None]]:
+        if not progress:
+            return None
+
+        def on_chunk(read):
+            progress(task.song_id, offset + read, total)
+
+        return on_chunk
+
+
+@dataclass
+class Checkpoint:
+    """Progress of a partial download, kept in a json file beside it"""
+
+    part: Path
+    size: int
+    done: int
+    validator: Optional[str] = None
+
+    @staticmethod
+    def path_for(part: Path) -> Path:
+        return part.with_name(part.name + ".json")
+
+    @classmethod
+    def load(cls, part: Path) -> Optional["Checkpoint"]:
+        try:
+            with open(cls.path_for(part), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return cls(part, data["size"], data["done"], data.get("validator"))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self):
+        path = self.path_for(self.part)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(
+                {"size": self.size, "done": self.done, "validator": self.validator}, f
+            )
+        os.replace(tmp, path)
+
+    def remove(self):
+        self.path_for(self.part).unlink(missing_ok=True)
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    """Audio container of a file from its first bytes"""
+    if head.startswith(b"fLaC"):
+        return "flac"
+    if head.startswith(b"ID3") or head[:2] in (b"\xff\xfb", b"\xff\xf3", b"\xff\xf2"):
+        return "mp3"
+    if head[4:8] == b"ftyp":
+        return "m4a"
+    if head.startswith(b"OggS"):
+        return "ogg"
+    return None
+
+
+def _hash_file(path: Path, md5) -> bytes:
+    """Add a file to md5, returning its first bytes"""
+    with open(path, "rb") as f:
+        head = f.read(HEAD_SIZE)
+        md5.update(head)
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            md5.update(block)
+    return head
+
+
+def _total_size(response: requests.Response, offset: int) -> int:
+    """Full size of the file, 0 if the server does not say"""
+    content_range = response.headers.get("Content-Range", "")
+    if "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        if total.isdigit():
+            return int(total)
+    length = int(response.headers.get("Content-Length", 0))
+    return offset + length if length else 0
@@ -0,0 +1,130 @@
+import os
+import re
+from operator import itemgetter
+from pathlib import Path
+
+# Only the standard library, this module is imported by render processes
+
+# A line starting with [mm:ss], [mm:ss.xx] or [mm:ss.xxx] tags, the first
+# one split out since most lines have only one
+LINE = re.compile(
+    r"^[ \t]*\[(\d+):(\d+)(?:[.:](\d+))?\]((?:\[\d+:\d+(?:[.:]\d+)?\])*)(.*)",
+    re.MULTILINE,
+)
+TIMESTAMP = re.compile(r"\[(\d+):(\d+)(?:[.:](\d+))?\]")
+# ms per unit of a fraction of one, two or three digits
+FRACTION_MS = (0, 100, 10, 1)
+OFFSET = re.compile(r"\[offset:\s*([+-]?\d+)\s*\]", re.IGNORECASE)
+# How long the last line stays on screen, in milliseconds
+LAST_LINE_DURATION = 5000
+# Bump when lrc_to_srt output changes, cached renders of older versions
+# are then ignored
+SRT_VERSION = 1
+
+
+def parse_lrc(lrc: str) -> list[tuple[int, str]]:
+    """
+    (milliseconds, text) of every timed line of an LRC lyric, by time.
+
+    A line with several timestamps is repeated at each of them. Fractions
+    of a second may have one to three digits, [offset:ms] shifts every
+    line, a positive offset making lines show earlier. Other tags such as
+    [ar:] or [ti:] are ignored.
+    """
+    offset = OFFSET.search(lrc)
+    offset = int(offset.group(1)) if offset else 0
+    lines = []
+    append = lines.append
+    for minutes, seconds, fraction, more, text in LINE.findall(lrc):
+        text = text.strip()
+        append((_ms(minutes, seconds, fraction, offset), text))
+        if more:
+            for minutes, seconds, fraction in TIMESTAMP.findall(more):
+                append((_ms(minutes, seconds, fraction, offset), text))
+    lines.sort(key=itemgetter(0))
+    return lines
+
+
+def _ms(minutes: str, seconds: str, fraction: str, offset: int) -> int:
+    ms = (int(minutes) * 60 + int(seconds)) * 1000
+    if fraction:
+        # .5 is 500 ms, .05 is 50 ms, .005 is 5 ms
+        ms += int(fraction[:3]) * FRACTION_MS[min(len(fraction), 3)]
+    return max(0, ms - offset)
+
+
+def srt_time(ms: int) -> str:
+    """HH:MM:SS,mmm"""
+    return "%02d:%02d:%02d,%03d" % (
+        ms // 3600000,
+        ms // 60000 % 60,
+        ms // 1000 % 60,
+        ms % 1000,
+    )
+
+
+def lrc_to_srt(lrc: str) -> str:
+    """
+    SRT subtitles of an LRC lyric. Every line lasts until the next one
+    starts, the last for LAST_LINE_DURATION. Empty lines only end the line
+    before them.
+    """
+    lines = parse_lrc(lrc)
+    # start of the first later line, found walking back from the end
+    ends = [0] * len(lines)
+    later = None
+    for i in range(len(lines) - 1, -1, -1):
+        start = lines[i][0]
+        if i + 1 < len(lines) and lines[i + 1][0] > start:
+            later = lines[i + 1][0]
+        ends[i] = later if later is not None else start + LAST_LINE_DURATION
+    # a line's end is the next one's start, format each time once
+    times = {ms: srt_time(ms) for ms in {*ends, *(start for start, _ in lines)}}
+    entries = []
+    for (start, text), end in zip(lines, ends):
+        if text:
+            entries.append(
+                f"{len(entries) + 1}\n{times[start]} --> {times[end]}\n{text}\n"
+            )
+    return "\n".join(entries)
+
+
+def write_file(path: str, text: str):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def write_files(files: list[tuple[str, str]]) -> int:
+    """Write (path, text) pairs, skipping empty texts. Returns how many"""
+    written = 0
+    for path, text in files:
+        if text:
+            write_file(path, text)
+            written += 1
+    return written
+
+
+def render_srt_files(lyrics: list[tuple]) -> list[tuple]:
+    """
+    Render (song_id, path, lrc) to SRT files, run in a worker process.
+    Returns (song_id, srt) of every lyric for the render cache, srt being
+    empty, and no file written, for lyrics without timed lines.
+    """
+    rendered = []
+    for song_id, path, lrc in lyrics:
+        srt = lrc_to_srt(lrc)
+        if srt:
+            write_file(path, srt)
+        rendered.append((song_id, srt))
+    return rendered
+
+
+def srt_filename(directory: Path, title: str, song_id, taken: set) -> Path:
+    """directory/title.srt, with the song id added if the name is taken"""
+    name = f"{title}.srt"
+    if name in taken:
+        name = f"{title} ({song_id}).srt"
+    taken.add(name)
+    return directory / name
@@ -1,85 +1,605 @@
+import asyncio
+import multiprocessing
 import os
+import shutil
 import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
-import requests
+from datetime import datetime, timezone
 from pathlib import Path
+from typing import Optional
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.netease.netease_api import NeteaseApi
-from app.mongodb.playlist import get_playlist as get_playlist_from_db, insert_playlist
-from app.mongodb.song import insert_songs, get_song as get_song_from_db, update_song
-from app.utils.log import logger
-from app.min_io.services import upload_file, presign_download, file_exists
+from app.netease.netease_api import NeteaseApi, fallback_qualities, level_qualities
+from app.netease.async_netease_api import AsyncNeteaseApi
+from app.netease.lyric import (
+    SRT_VERSION,
+    lrc_to_srt,
+    render_srt_files,
+    srt_filename,
+    write_files,
+)
+from app.netease.downloader import (
+    Downloader,
+    DownloadResult,
+    DownloadTask,
+    ProgressCallback,
+)
+from app.mongodb.playlist import (
+    get_playlist as get_playlist_from_db,
+    get_removed_track_ids,
+    upsert_playlists,
+)
+from app.mongodb.records import Playlist, Song, track_id_array
+from app.mongodb.song import (
+    upsert_songs,
+    get_song as get_song_from_db,
+    get_songs as get_songs_from_db,
+)
+from app.mongodb.lyric import (
+    get_lyric as get_lyric_from_db,
+    get_rendered,
+    lyric_hash,
+    set_lyric,
+    set_rendered,
+)
+from app.mongodb import async_lyric, async_playlist, async_song
+from app.utils.cache import song_cache, netease_url_cache
+from app.utils.disk_cache import DiskCache, get_disk_cache
+from app.utils.filename import safe_filename
+from app.utils.log import SampledLog, logger
+from app.utils.metrics import add_bytes, timed
+from app.min_io.services import (
+    presign_songs_download,
+    presign_downloads,
+    content_object_name,
+    existing_objects,
+    upload_stream,
+)
 from app.min_io.client import BucketName
+from app.constants.env import lyric_render_chunk, lyric_render_processes
+
+
+def resolve_songs_url(
+    fetched: list[dict], song_ids: list, tier: str
+) -> tuple[list[dict], dict]:
+    """
+    Split urls fetched at a quality tier into those with a url, tagged with
+    the quality actually obtained, and {id: entry} of songs still without
+    one, entry being None if netease did not return the song at all.
+    """
+    by_id = {url["id"]: url for url in fetched}
+    resolved = []
+    unresolved = {}
+    for song_id in song_ids:
+        url = by_id.get(song_id)
+        if url and url.get("url"):
+            # netease may serve a lower level than asked for
+            url["quality"] = level_qualities.get(url.get("level"), tier)
+            resolved.append(url)
+        else:
+            unresolved[song_id] = url
+    return resolved, unresolved
+
+
+def unresolved_songs_url(unresolved: dict) -> list[dict]:
+    """Entries without a url for songs no tier could resolve"""
+    return [
+        {**(url or {"id": song_id}), "url": None, "quality": None}
+        for song_id, url in unresolved.items()
+    ]
+
+
+def in_order(urls: list[dict], song_ids: list) -> list[dict]:
+    by_id = {url["id"]: url for url in urls}
+    return [by_id[song_id] for song_id in song_ids if song_id in by_id]
+
+
+def add_songs_url_tier(
+    urls: list[dict], fetched: list[dict], unresolved: dict, tier: str, quality: str
+) -> dict:
+    """
+    One rung of the quality fallback: add the urls fetched at tier for the
+    unresolved songs to urls and cache them, returning the songs still
+    unresolved.
+    """
+    resolved, unresolved = resolve_songs_url(fetched, list(unresolved), tier)
+    cache_songs_url(resolved, quality)
+    urls.extend(resolved)
+    return unresolved
+
+
+def cache_songs_url(urls: list[dict], quality: str):
+    for url in urls:
+        if url.get("url"):
+            # expi is how many seconds the url stays valid, leave a margin
+            ttl = url["expi"] * 0.8 if url.get("expi") else None
+            netease_url_cache.set((url["id"], quality), url, ttl)
+
+
+def cached_songs_url(song_ids: list, quality: str) -> tuple[list[dict], list]:
+    """Cached netease urls for song_ids, and the ids that are not cached"""
+    urls = []
+    uncached_ids = []
+    for song_id in song_ids:
+        url = netease_url_cache.get((song_id, quality))
+        if url:
+            urls.append(url)
+        else:
+            uncached_ids.append(song_id)
+    return urls, uncached_ids
+
+
+def minio_song_url(song_id, url: str, audio: dict) -> dict:
+    """Download entry for audio already stored in MinIO"""
+    return {
+        "id": song_id,
+        "url": url,
+        "is_minio": True,
+        "format": audio.get("format") or "mp3",
+        "md5": audio.get("md5"),
+        "size": audio.get("size"),
+    }
+
+
+def netease_song_url(url: dict) -> dict:
+    """Download entry for a netease song url"""
+    return {
+        **url,
+        "is_minio": False,
+        "format": (url.get("type") or "mp3").lower(),
+    }
+
+
+def audio_records(
+    tasks: list[DownloadTask],
+    results: list[DownloadResult],
+    songs_url: list[dict],
+    quality: str,
+) -> list[dict]:
+    """Checksum, size, quality and format of newly uploaded audio, per song"""
+    urls = {song_url["id"]: song_url for song_url in songs_url}
+    records = []
+    for task, result in zip(tasks, results):
+        if not (result.ok and result.uploaded):
+            continue
+        song_url = urls[task.song_id]
+        records.append(
+            {
+                "id": task.song_id,
+                "audio": {
+                    "md5": result.md5,
+                    "size": result.size,
+                    "quality": song_url.get("quality") or quality,
+                    "format": result.format or song_url.get("format") or "mp3",
+                    "object": task.object_name,
+                },
+            }
+        )
+    return records
+
+
+def is_up_to_date(stored: Optional[Playlist], page: dict) -> bool:
+    """Whether the tracks of a playlist did not change since it was stored"""
+    update_time = page.get("trackUpdateTime") or page.get("updateTime")
+    return bool(stored and update_time and stored.update_time == update_time)
+
+
+def unchanged_playlist(stored: Playlist) -> dict:
+    logger.info(f"Playlist {stored.name} ID:{stored.id} is up to date")
+    return {"id": stored.id, "changed": False, "added": [], "removed": []}
+
+
+def track_changes(stored: Optional[Playlist], track_ids: list) -> tuple[list, list]:
+    """Track ids added and removed since the stored copy"""
+    stored_ids = stored.track_ids if stored else []
+    current, previous = set(track_ids), set(stored_ids)
+    added = [track_id for track_id in track_ids if track_id not in previous]
+    removed = [track_id for track_id in stored_ids if track_id not in current]
+    return added, removed
+
+
+def synced_playlist_doc(
+    playlist_id: int, page: dict, track_ids: list, removed_track_ids: list
+) -> dict:
+    """Playlist document of a sync, removed_track_ids including earlier ones"""
+    playlist = Playlist(
+        playlist_id,
+        page.get("name", ""),
+        page.get("description", ""),
+        track_id_array(track_ids),
+        page.get("trackUpdateTime") or page.get("updateTime"),
+    )
+    current = set(track_ids)
+    return {
+        **playlist.to_doc(),
+        "synced_at": datetime.now(timezone.utc),
+        # tracks added back are no longer removed
+        "removed_track_ids": [
+            track_id
+            for track_id in dict.fromkeys(removed_track_ids)
+            if track_id not in current
+        ],
+    }
+
+
+def synced_playlist(doc: dict, added: list, removed: list) -> dict:
+    logger.info(
+        f"Synced playlist {doc['name']} ID:{doc['id']}: "
+        f"{len(added)} added, {len(removed)} removed"
+    )
+    return {"id": doc["id"], "changed": True, "added": added, "removed": removed}
+
+
+def local_results(
+    disk_cache: DiskCache, song_ids: list, songs: dict, bucket: str
+) -> tuple[list[DownloadResult], list[dict]]:
+    """
+    Results of songs whose audio is on local disk, and audio records of
+    those that had none or were uploaded.
+
+    A file is used if it matches the size and md5 recorded for the song's
+    audio or, for songs without a record, the md5 it was cached with. Its
+    MinIO object is checked to exist and uploaded from the file if it does
+    not, so a local hit is still mirrored. Songs whose upload fails get a
+    failed result.
+    """
+    hits = {}
+    for song_id in song_ids:
+        song = songs.get(song_id)
+        audio = (song.audio if song else None) or {}
+        hit = disk_cache.get(song_id, audio.get("size") or 0, audio.get("md5"))
+        if hit:
+            path, md5 = hit
+            fmt = audio.get("format") or path.suffix[1:]
+            object_name = audio.get("object") or content_object_name(md5, fmt)
+            hits[song_id] = (path, md5, fmt, object_name, audio)
+    existing = existing_objects([hit[3] for hit in hits.values()], bucket)
+
+    results = []
+    records = []
+    for song_id, (path, md5, fmt, object_name, audio) in hits.items():
+        size = path.stat().st_size
+        uploaded = object_name not in existing
+        if uploaded:
+            logger.info(f"Uploading song {song_id} from {path}, missing in minio")
+            with open(path, "rb") as f:
+                if not upload_stream(object_name, f, size, bucket_name=bucket):
+                    results.append(
+                        DownloadResult(
+                            song_id, path, ok=False, error="upload to minio failed"
+                        )
+                    )
+                    continue
+        if uploaded or not audio:
+            records.append(
+                {
+                    "id": song_id,
+                    "audio": {
+                        "md5": md5,
+                        "size": size,
+                        # unknown for files cached before the song was recorded
+                        "quality": audio.get("quality"),
+                        "format": fmt,
+                        "object": object_name,
+                    },
+                }
+            )
+        add_bytes("disk_cache.hit", size)
+        results.append(
+            DownloadResult(
+                song_id,
+                path,
+                ok=True,
+                size=size,
+                uploaded=uploaded,
+                md5=md5,
+                format=fmt,
+            )
+        )
+    return results, records
+
+
+def cache_results(
+    disk_cache: DiskCache,
+    results: list[DownloadResult],
+    song_ids: list,
+    save_to: Optional[Path],
+):
+    """
+    Add files downloaded into the cache directory, copy every song's file
+    out of it to save_to, then evict and save the index.
+    """
+    for result in results:
+        if result.ok and result.filename:
+            if result.filename.parent == disk_cache.directory:
+                disk_cache.put(result.song_id, result.filename, result.size, result.md5)
+    if save_to:
+        save_to.mkdir(parents=True, exist_ok=True)
+        for result in results:
+            if result.ok and result.filename:
+                copy = save_to / result.filename.name
+                shutil.copyfile(result.filename, copy)
+                result.filename = copy
+    disk_cache.evict(protect=song_ids)
+    disk_cache.save()
 
 
 class Netease:
     def __init__(self, cookie_file: str):
         self.netease_api = NeteaseApi(cookie_file)
+        self.async_api = AsyncNeteaseApi(self.netease_api)
 
+    @timed("song.download")
     async def download_song(
-        self, song_ids: list, download_directory="music", quality: str = "lossless"
+        self,
+        song_ids: list,
+        download_directory="music",
+        quality: str = "lossless",
+        on_progress: Optional[ProgressCallback] = None,
+        save_local: bool = True,
     ):
-        logger.info(f"Downloading songs {song_ids} with quality {quality}")
-        missing_song_ids = []
+        """
+        Make sure every song is in MinIO, downloading missing ones from
+        Netease straight into the bucket. With save_local a copy of each
+        song is also written to download_directory.
+
+        Songs are looked up on local disk first, then in MinIO, then on
+        Netease. Songs in the local disk cache (see utils/disk_cache) are
+        served from it once their MinIO object is confirmed, or uploaded
+        from the local file if it is missing. Downloads from Netease are
+        kept in the cache on the way to MinIO.
+
+        Audio is stored once per content hash: a song whose Netease md5
+        matches audio already in MinIO is pointed at that object instead
+        of being uploaded again.
+        """
+        logger.info("Downloading {} songs with quality {}", len(song_ids), quality)
+        songs = await self.get_songs_async(song_ids)
+        songs = {song.id: song for song in songs}
         songs_url = []
-        # Get song url from minio
-        for song_id in song_ids:
-            if file_exists(f"{song_id}.mp3", BucketName.MUSIC_PLAYLIST.value):
-                song_url = presign_download(
-                    f"{song_id}.mp3", BucketName.MUSIC_PLAYLIST.value
+        bucket = BucketName.MUSIC_PLAYLIST.value
+        music_dir = Path(download_directory)
+        disk_cache = await asyncio.to_thread(get_disk_cache)
+        if disk_cache is not None and (
+            disk_cache.directory.resolve() == music_dir.resolve()
+        ):
+            # The cache evicts what it writes, it must not own the user's files
+            logger.warning(
+                f"Local cache {disk_cache.directory} is the download directory, not using it"
+            )
+            disk_cache = None
+        local = []
+        local_records = []
+        if disk_cache is not None:
+            local, local_records = await asyncio.to_thread(
+                local_results, disk_cache, song_ids, songs, bucket
+            )
+            if local:
+                logger.info(f"Got {len(local)} songs from {disk_cache.directory}")
+            if on_progress:
+                for result in local:
+                    if result.ok:
+                        on_progress(result.song_id, result.size, result.size)
+        local_ids = {result.song_id for result in local}
+        # Files are written to the cache, and copied out if save_local
+        local_dir = music_dir if disk_cache is None else disk_cache.directory
+
+        # Songs whose audio metadata is recorded point at a known object
+        stored = {
+            song_id: songs[song_id].audio
+            for song_id in song_ids
+            if song_id in songs and songs[song_id].audio and song_id not in local_ids
+        }
+        if stored:
+            presigned = await asyncio.to_thread(
+                presign_downloads,
+                [audio["object"] for audio in stored.values()],
+                bucket,
+            )
+            for song_id, audio in stored.items():
+                songs_url.append(
+                    minio_song_url(song_id, presigned[audio["object"]], audio)
+                )
+
+        # Older objects are only keyed by song id
+        legacy_ids = [
+            song_id
+            for song_id in song_ids
+            if song_id not in stored and song_id not in local_ids
+        ]
+        minio_urls = await asyncio.to_thread(presign_songs_download, legacy_ids, bucket)
+        missing_song_ids = []
+        for song_id in legacy_ids:
+            if song_id in minio_urls:
+                songs_url.append(
+                    {
+                        "id": song_id,
+                        "url": minio_urls[song_id],
+                        "is_minio": True,
+                        "format": "mp3",
+                    }
                 )
-                print(song_url)
-                songs_url.append({"id": song_id, "url": song_url, "is_minio": True})
             else:
                 missing_song_ids.append(song_id)
         logger.info(f"Got {len(songs_url)} songs url from minio")
+
         # If missing song ids, get song url from netease api
         if len(missing_song_ids) > 0:
             logger.info(f"Getting {len(missing_song_ids)} songs url from netease api")
-            songs_url.extend(self.get_songs_url(missing_song_ids, quality))
-            logger.info(f"Got {len(songs_url)} songs url from netease api")
+            netease_urls = await self.get_songs_url_async(missing_song_ids, quality)
+            songs_url.extend(await self._dedup_songs_url(netease_urls, bucket))
+            logger.info(f"Got {len(netease_urls)} songs url from netease api")
 
+        tasks = []
+        no_url = []
+        queued = SampledLog("Queued downloads")
         for song_url in songs_url:
             if not song_url["url"]:
-                logger.error(f"No url found for song {song['id']}")
+                no_url.append(song_url["id"])
                 continue
-            song_id = song_url["id"]
-            song = self.get_song(song_id)
-            logger.info(f"Downloading song {song['name']} ID:{song['id']}")
-            # Create music directory if it doesn't exist
-            music_dir = Path(download_directory)
-            music_dir.mkdir(exist_ok=True)
-
-            # Download the song
-            response = requests.get(song_url["url"], stream=True)
-            if response.status_code == 200:
-                # Use song id as filename since we don't have song name info here
-                filename = music_dir / f"{song['id']}.mp3"
-
-                logger.info(f"Downloading to {filename}...")
-                with open(filename, "wb") as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                if not song_url["is_minio"]:
-                    await upload_file(
-                        f"{song['id']}.mp3", filename, BucketName.MUSIC_PLAYLIST.value
-                    )
-                logger.info(f"Download complete!")
+            # Only MinIO entries are tagged, anything else came from netease
+            is_minio = song_url.get("is_minio", False)
+            if is_minio and not save_local:
+                # Already stored and no local copy wanted, nothing to move
+                continue
+            song = songs.get(song_url["id"]) or Song(song_url["id"])
+            queued.item("Downloading song {} ID:{}", song.name, song.id)
+            fmt = song_url.get("format") or "mp3"
+            if is_minio:
+                object_name = None
+            elif song_url.get("md5"):
+                # Netease downloads are teed into MinIO while streaming
+                object_name = content_object_name(song_url["md5"].lower(), fmt)
+            else:
+                object_name = f"{song.id}.{fmt}"
+            # Use song id as filename since song names are not unique
+            # Netease downloads are kept in the local cache, if there is one
+            keep = save_local or disk_cache is not None
+            tasks.append(
+                DownloadTask(
+                    song.id,
+                    song_url["url"],
+                    filename=local_dir / f"{song.id}.{fmt}" if keep else None,
+                    object_name=object_name,
+                    md5=song_url.get("md5"),
+                    size=song_url.get("size") or 0,
+                )
+            )
+
+        queued.summary()
+        if no_url:
+            logger.error("No url found for songs {}", no_url)
+
+        downloader = Downloader()
+        try:
+            results = await downloader.download_all(tasks, on_progress)
+        finally:
+            downloader.close()
+
+        await async_song.upsert_songs(
+            audio_records(tasks, results, songs_url, quality) + local_records
+        )
+        if disk_cache is not None:
+            await asyncio.to_thread(
+                cache_results,
+                disk_cache,
+                local + results,
+                song_ids,
+                music_dir if save_local else None,
+            )
+        results = local + results
+
+        failed = [result.song_id for result in results if not result.ok]
+        logger.info(
+            f"Download complete! {len(results) - len(failed)} succeeded, {len(failed)} failed"
+        )
+        if failed:
+            logger.error(f"Failed to download songs {failed}")
+        return results
+
+    async def _dedup_songs_url(self, netease_urls: list[dict], bucket: str):
+        """
+        Netease urls of songs to download, with songs whose audio is already
+        stored under its md5 redirected to that object and aliased to it.
+        """
+        md5s = [url["md5"].lower() for url in netease_urls if url.get("md5")]
+        existing = await async_song.find_audio(md5s)
+        if not existing:
+            return [netease_song_url(url) for url in netease_urls]
+
+        songs_url = []
+        aliases = []
+        for url in netease_urls:
+            audio = existing.get((url.get("md5") or "").lower())
+            if url.get("url") and audio:
+                aliases.append({"id": url["id"], "audio": audio})
+            else:
+                songs_url.append(netease_song_url(url))
+        if aliases:
+            logger.info(f"{len(aliases)} songs share audio already in minio")
+            await async_song.upsert_songs(aliases)
+            presigned = await asyncio.to_thread(
+                presign_downloads,
+                list({alias["audio"]["object"] for alias in aliases}),
+                bucket,
+            )
+            for alias in aliases:
+                audio = alias["audio"]
+                songs_url.append(
+                    minio_song_url(alias["id"], presigned[audio["object"]], audio)
+                )
+        return songs_url
+
+    def get_songs_url(
+        self, song_ids: list, quality: str = "lossless", fallback: bool = True
+    ) -> list[dict]:
+        """
+        Playable urls of songs at quality, in the order of song_ids.
+
+        With fallback, songs not available at quality are asked for again
+        at each lower rung of quality_ladder, one batch per rung, so a whole
+        playlist takes at most one request per rung. Every entry's quality
+        is what was obtained, None with url None if no rung had the song.
+        """
+
+        logger.info("Getting {} songs url with quality {}", len(song_ids), quality)
+        urls, uncached_ids = cached_songs_url(song_ids, quality)
+        unresolved = dict.fromkeys(uncached_ids)
+        for tier in fallback_qualities(quality) if fallback else [quality]:
+            if not unresolved:
+                break
+            fetched = self.netease_api.get_songs_url_with_quality(
+                list(unresolved), tier
+            )
+            unresolved = add_songs_url_tier(urls, fetched, unresolved, tier, quality)
+        self._log_songs_url(urls, unresolved, len(song_ids) - len(uncached_ids))
+        return in_order(urls + unresolved_songs_url(unresolved), song_ids)
 
-    def get_songs_url(self, song_ids: list, quality: str = "lossless"):
-        logger.info(f"Getting songs url for {song_ids} with quality {quality}")
-        urls = self.netease_api.get_songs_url_with_quality(song_ids, quality)
-        logger.info(f"Got {len(urls)} songs url")
-        return urls
+    async def get_songs_url_async(
+        self, song_ids: list, quality: str = "lossless", fallback: bool = True
+    ) -> list[dict]:
+        """Async get_songs_url"""
+        logger.info("Getting {} songs url with quality {}", len(song_ids), quality)
+        urls, uncached_ids = cached_songs_url(song_ids, quality)
+        unresolved = dict.fromkeys(uncached_ids)
+        for tier in fallback_qualities(quality) if fallback else [quality]:
+            if not unresolved:
+                break
+            fetched = await self.async_api.get_songs_url_with_quality(
+                list(unresolved), tier
+            )
+            unresolved = add_songs_url_tier(urls, fetched, unresolved, tier, quality)
+        self._log_songs_url(urls, unresolved, len(song_ids) - len(uncached_ids))
+        return in_order(urls + unresolved_songs_url(unresolved), song_ids)
 
-    def get_playlist(self, playlist_id: int):
+    @staticmethod
+    def _log_songs_url(urls: list[dict], unresolved: dict, cached: int):
+        qualities = Counter(url["quality"] for url in urls)
+        logger.info(
+            "Got {} songs url, {} cached, by quality {}",
+            len(urls),
+            cached,
+            dict(qualities),
+        )
+        if unresolved:
+            logger.error("No url at any quality for songs {}", list(unresolved))
+
+    @timed("playlist.get", trace="playlist_id")
+    def get_playlist(self, playlist_id: int, sync: bool = False) -> Playlist:
+        """
+        Get a playlist with its tracks. The stored copy is served as is
+        unless sync is set, which first brings it up to date with
+        sync_playlist.
+        """
+        if sync:
+            self.sync_playlist(playlist_id)
         logger.info(f"Getting playlist {playlist_id} from db")
         playlist = get_playlist_from_db(playlist_id)
         if playlist:
-            logger.info(f"Playlist {playlist['name']} ID:{playlist_id} found in db")
+            logger.info(f"Playlist {playlist.name} ID:{playlist_id} found in db")
             playlist = self.get_playlist_songs(playlist)
             return playlist
         # no playlist in mongodb, get playlist from netease api
@@ -87,151 +607,340 @@ class Netease:
         playlist_name, playlist_description, track_ids = self.netease_api.get_playlist(
             playlist_id
         )
-        playlist = {
-            "id": playlist_id,
-            "name": playlist_name,
-            "description": playlist_description,
-            "track_ids": track_ids,
-        }
-        insert_playlist(playlist)
-        logger.info(f"Playlist {playlist['name']} ID:{playlist_id} inserted into db")
+        playlist = Playlist(
+            playlist_id, playlist_name, playlist_description, track_id_array(track_ids)
+        )
+        upsert_playlists([playlist.to_doc()])
+        logger.info(f"Playlist {playlist.name} ID:{playlist_id} inserted into db")
         playlist = self.get_playlist_songs(playlist)
         return playlist
 
-    def get_playlist_songs(self, playlist: dict):
-        logger.info(
-            f"Getting songs for playlist {playlist['name']} ID:{playlist['id']}"
+    @timed("playlist.sync", trace="playlist_id")
+    def sync_playlist(self, playlist_id: int) -> dict:
+        """
+        Bring the stored copy of a playlist up to date with netease api.
+
+        A single detail request tells whether the tracks changed since the
+        last sync. Only if they did is the full track list read, details
+        fetched for the added tracks and removed tracks recorded in
+        removed_track_ids.
+
+        Returns the added and removed track ids.
+        """
+        logger.info(f"Syncing playlist {playlist_id}")
+        stored = get_playlist_from_db(playlist_id)
+        page = self.netease_api.get_playlist_page(playlist_id, 0)
+        if is_up_to_date(stored, page):
+            return unchanged_playlist(stored)
+
+        track_ids = self.netease_api.get_playlist_track_ids(playlist_id, page)
+        added, removed = track_changes(stored, track_ids)
+        removed_history = get_removed_track_ids(playlist_id) if stored else []
+        if added:
+            # only the added tracks can be missing from the db
+            self.get_songs(added)
+        doc = synced_playlist_doc(
+            playlist_id, page, track_ids, removed_history + removed
         )
-        track_ids = playlist["track_ids"]
-        tracks = []
-        missing_track_ids = []
-        missing_tracks = []
-        for track_id in track_ids:
-            # get song from mongodb
-            song = get_song_from_db(track_id)
-            if song:
-                logger.info(f"Song {song['name']} ID:{song['id']} found in db")
-                tracks.append(song)
-            else:
-                logger.info(
-                    f"Song {track_id} not found in db, getting from netease api"
-                )
-                missing_track_ids.append(track_id)
-        # if missing track ids, get songs from netease api
-        if len(missing_track_ids) > 0:
-            logger.info(f"Getting {len(missing_track_ids)} songs from netease api")
-            songs_data = self.netease_api.get_songs(missing_track_ids)
-            for song in songs_data:
-                missing_tracks.append(
-                    {
-                        "id": song.get("id", ""),
-                        "name": song.get("name", ""),
-                        "singer": song.get("ar", [{}])[0],
-                        "album": song.get("al", {}),
-                    }
-                )
-            # insert missing songs to mongodb
-            insert_songs(missing_tracks)
-            logger.info(f"Inserted {len(missing_tracks)} songs to db")
-            tracks.extend(missing_tracks)
-        playlist["tracks"] = tracks
+        upsert_playlists([doc])
+        return synced_playlist(doc, added, removed)
+
+    @timed("playlist.sync", trace="playlist_id")
+    async def sync_playlist_async(self, playlist_id: int) -> dict:
+        """
+        Async sync_playlist, netease calls go through the shared rate
+        limiter and are coalesced with concurrent ones.
+        """
+        logger.info(f"Syncing playlist {playlist_id}")
+        stored = await async_playlist.get_playlist(playlist_id)
+        page = await self.async_api.get_playlist_page(playlist_id, 0)
+        if is_up_to_date(stored, page):
+            return unchanged_playlist(stored)
+
+        track_ids = await self.async_api.get_playlist_track_ids(playlist_id, page)
+        added, removed = track_changes(stored, track_ids)
+        removed_history = (
+            await async_playlist.get_removed_track_ids(playlist_id) if stored else []
+        )
+        if added:
+            await self.get_songs_async(added)
+        doc = synced_playlist_doc(
+            playlist_id, page, track_ids, removed_history + removed
+        )
+        await async_playlist.upsert_playlists([doc])
+        return synced_playlist(doc, added, removed)
+
+    @timed("playlist.get", trace="playlist_id")
+    async def get_playlist_async(self, playlist_id: int) -> Playlist:
+        logger.info(f"Getting playlist {playlist_id} from db")
+        playlist = await async_playlist.get_playlist(playlist_id)
+        if not playlist:
+            logger.info(
+                f"Playlist {playlist_id} not found in db, getting from netease api"
+            )
+            playlist_name, playlist_description, track_ids = (
+                await self.async_api.get_playlist(playlist_id)
+            )
+            playlist = Playlist(
+                playlist_id,
+                playlist_name,
+                playlist_description,
+                track_id_array(track_ids),
+            )
+            await async_playlist.upsert_playlists([playlist.to_doc()])
+            logger.info(f"Playlist {playlist.name} ID:{playlist_id} inserted into db")
+        playlist.tracks = await self.get_songs_async(playlist.track_ids)
+        return playlist
+
+    def get_playlist_songs(self, playlist: Playlist) -> Playlist:
+        logger.info(f"Getting songs for playlist {playlist.name} ID:{playlist.id}")
+        playlist.tracks = self.get_songs(playlist.track_ids)
         return playlist
 
-    def get_lyric(self, song_id):
+    def get_songs(self, song_ids) -> list[Song]:
+        """
+        Get details without lyrics for many songs, in the order of song_ids,
+        from the db with one query and from netease api for the rest.
+        """
+        songs, missing_ids = get_songs_from_db(song_ids)
+        logger.info(f"Found {len(songs)} of {len(song_ids)} songs in db")
+        # if missing ids, get songs from netease api
+        if len(missing_ids) > 0:
+            logger.info(f"Getting {len(missing_ids)} songs from netease api")
+            songs_data = self.netease_api.get_songs(missing_ids)
+            missing_songs = [Song.from_netease(song) for song in songs_data]
+            # insert missing songs to mongodb
+            counts = upsert_songs([song.to_doc() for song in missing_songs])
+            logger.info(
+                f"Upserted {len(missing_songs)} songs to db: {counts['inserted']} inserted, "
+                f"{counts['updated']} updated, {counts['unchanged']} unchanged"
+            )
+            songs.extend(missing_songs)
+        found = {}
+        for song in songs:
+            found[song.id] = song
+            song_cache.set(song.id, song)
+        # keep the order of song_ids
+        return [found[song_id] for song_id in song_ids if song_id in found]
+
+    @timed("lyric.get", trace="song_id")
+    def get_lyric(self, song_id) -> tuple[str, Song]:
         """Get lyric from db, if no lyric in db
         then get lyric from netease api and upload to db"""
-        logger.info(f"Getting lyric for song {song_id}")
+        logger.debug("Getting lyric for song {}", song_id)
         song = self.get_song(song_id)
-        if song:
-            lyric = song.get("lyric", "")
-            if lyric:
-                logger.info(
-                    f"Lyric for song {song['name']} ID:{song['id']} found in db"
-                )
-                return lyric, song
-        logger.info(
-            f"Lyric for song {song['name']} ID:{song['id']} not found in db, getting from netease api"
+        lyric = get_lyric_from_db(song_id)
+        # "" is stored for songs without a lyric
+        if lyric is not None:
+            logger.debug("Lyric for song {} ID:{} found in db", song.name, song.id)
+            return lyric, song
+        logger.debug(
+            "Lyric for song {} ID:{} not found in db, getting from netease api",
+            song.name,
+            song.id,
         )
         lyric = self.netease_api.get_lyric(song_id)
-        logger.info(
-            f"Lyric for song {song['name']} ID:{song['id']} got from netease api"
-        )
-        song["lyric"] = lyric
-        update_song(song)
-        logger.info(f"Lyric for song {song['name']} ID:{song['id']} inserted into db")
+        logger.debug("Lyric for song {} ID:{} got from netease api", song.name, song.id)
+        set_lyric(song_id, lyric)
+        logger.debug("Lyric for song {} ID:{} inserted into db", song.name, song.id)
+        return lyric, song
+
+    @timed("lyric.get", trace="song_id")
+    async def get_lyric_async(self, song_id) -> tuple[str, Song]:
+        logger.debug("Getting lyric for song {}", song_id)
+        songs = await self.get_songs_async([song_id])
+        song = songs[0]
+        lyric = await async_lyric.get_lyric(song_id)
+        if lyric is not None:
+            logger.debug("Lyric for song {} ID:{} found in db", song.name, song.id)
+            return lyric, song
+        lyric = await self.async_api.get_lyric(song_id)
+        await async_lyric.set_lyric(song_id, lyric)
+        logger.debug("Lyric for song {} ID:{} inserted into db", song.name, song.id)
         return lyric, song
 
-    def get_song(self, song_id):
-        logger.info(f"Getting song {song_id} from db")
+    async def get_songs_async(self, song_ids) -> list[Song]:
+        """
+        Get details without lyrics for many songs, in the order of song_ids.
+        Looks in the cache, then in the db with one query, then asks netease
+        api for the rest in one pass.
+        """
+        found = {}
+        uncached_ids = []
+        for song_id in song_ids:
+            song = song_cache.get(song_id)
+            if song:
+                found[song_id] = song
+            else:
+                uncached_ids.append(song_id)
+        if uncached_ids:
+            songs, missing_ids = await async_song.get_songs(uncached_ids)
+            if missing_ids:
+                logger.info(f"Getting {len(missing_ids)} songs from netease api")
+                songs_data = await self.async_api.get_songs(missing_ids)
+                missing_songs = [Song.from_netease(song) for song in songs_data]
+                await async_song.upsert_songs([song.to_doc() for song in missing_songs])
+                songs.extend(missing_songs)
+            for song in songs:
+                found[song.id] = song
+                song_cache.set(song.id, song)
+        return [found[song_id] for song_id in song_ids if song_id in found]
+
+    @timed("song.get", trace="song_id")
+    def get_song(self, song_id) -> Song:
+        """Get song details without the lyric, from cache, db or netease api"""
+        song = song_cache.get(song_id)
+        if song:
+            return song
+        logger.debug("Getting song {} from db", song_id)
         song = get_song_from_db(song_id)
         if song:
-            logger.info(f"Song {song['name']} ID:{song['id']} found in db")
+            logger.debug("Song {} ID:{} found in db", song.name, song.id)
+            song_cache.set(song_id, song)
             return song
-        logger.info(f"Song {song_id} not found in db, getting from netease api")
+        logger.debug("Song {} not found in db, getting from netease api", song_id)
         songs_data = self.netease_api.get_songs([song_id])
         songs = []
         for song in songs_data:
-            logger.info(f"Song {song['name']} ID:{song['id']} got from netease api")
-            songs.append(
-                {
-                    "id": song.get("id", ""),
-                    "name": song.get("name", ""),
-                    "singer": song.get("ar", [{}])[0],
-                    "album": song.get("al", {}),
-                }
-            )
-        insert_songs(songs)
-        logger.info(f"Inserted {songs[0]['name']} ID:{songs[0]['id']} to db")
+            logger.debug("Song {} ID:{} got from netease api", song["name"], song["id"])
+            songs.append(Song.from_netease(song))
+        upsert_songs([song.to_doc() for song in songs])
+        logger.debug("Inserted {} ID:{} to db", songs[0].name, songs[0].id)
+        song_cache.set(song_id, songs[0])
         return songs[0]
 
+    @timed("lyric.srt", trace="song_id")
+    def get_srt(self, song_id) -> tuple[str, Song]:
+        """
+        SRT subtitles of a song's lyric. Rendered once, then read from the
+        render cache until the lyric changes.
+        """
+        cached = get_rendered([song_id], "srt", SRT_VERSION)
+        if song_id in cached:
+            return cached[song_id], self.get_song(song_id)
+        lyric, song = self.get_lyric(song_id)
+        srt = lrc_to_srt(lyric)
+        set_rendered({song_id: (lyric_hash(lyric), srt)}, "srt", SRT_VERSION)
+        return srt, song
+
+    @timed("lyric.export", trace="song_id")
     def export_song_lyric_srt_file(self, song_id):
         logger.info(f"Exporting lyric for song {song_id}")
-        lyric, song = self.get_lyric(song_id)
-        if not lyric:
+        srt, song = self.get_srt(song_id)
+        if not srt:
             logger.error(f"No lyric found for song {song_id}")
             return False
 
-        filename = f"{song['name']} - {song['singer']['name']}.srt"
-
+        filename = f"{safe_filename(f'{song.name} - {song.singer_name}')}.srt"
         try:
             with open(filename, "w", encoding="utf-8") as f:
-                lines = lyric.split("\n")
-                counter = 1
-
-                for i in range(0, len(lines), 2):
-                    if i + 1 >= len(lines):
-                        break
-
-                    time_line = lines[i]
-                    if not time_line.startswith("["):
-                        continue
-
-                    # Extract timestamp
-                    time_str = time_line[1 : time_line.find("]")]
-                    try:
-                        minutes, seconds = time_str.split(":")
-                        start_time = f"00:{minutes}:{seconds},000"
-
-                        # Calculate end time (assume 3 seconds duration)
-                        min_val = int(minutes)
-                        sec_val = float(seconds) + 3
-                        if sec_val >= 60:
-                            sec_val -= 60
-                            min_val += 1
-                        end_time = f"00:{min_val:02d}:{sec_val:06.3f}".replace(".", ",")
-
-                        # Write SRT entry
-                        f.write(f"{counter}\n")
-                        f.write(f"{start_time} --> {end_time}\n")
-                        f.write(f"{lines[i + 1]}\n\n")
-                        counter += 1
-
-                    except ValueError:
-                        continue
-
+                f.write(srt)
             logger.info(f"Successfully exported lyric to SRT file: {filename}")
             return True
-
-        except Exception as e:
+        except OSError as e:
             logger.error(f"Failed to create SRT file: {e}")
             return False
+
+    @timed("lyric.export_playlist", trace="playlist_id")
+    async def export_playlist_lyrics(
+        self,
+        playlist_id: int,
+        directory="lyrics",
+        processes: int = lyric_render_processes,
+        chunk_size: int = lyric_render_chunk,
+    ) -> dict:
+        """
+        Write an SRT file to directory for every track of a playlist that
+        has a lyric.
+
+        SRTs rendered by an earlier export are read from the render cache
+        with one query per chunk of ids and written as they are. For the
+        other tracks stored lyrics are read the same way, missing ones are
+        fetched from netease api concurrently and stored with one bulk
+        write. Those are parsed and rendered in a pool of processes worker
+        processes (0 for one per cpu), chunk_size songs at a time, and the
+        results added to the render cache.
+
+        Returns how many tracks were exported, read from the render cache,
+        rendered, fetched and had no lyric.
+        """
+        playlist = await self.get_playlist_async(playlist_id)
+        song_ids = [song.id for song in playlist.tracks]
+        cached = await async_lyric.get_rendered(song_ids, "srt", SRT_VERSION)
+        uncached_ids = [song_id for song_id in song_ids if song_id not in cached]
+        lyrics = await async_lyric.get_lyrics(uncached_ids)
+        missing_ids = [song_id for song_id in uncached_ids if song_id not in lyrics]
+        fetched = {}
+        if missing_ids:
+            logger.info(f"Getting {len(missing_ids)} lyrics from netease api")
+            results = await asyncio.gather(
+                *(self.async_api.get_lyric(song_id) for song_id in missing_ids),
+                return_exceptions=True,
+            )
+            failed = []
+            for song_id, lyric in zip(missing_ids, results):
+                if isinstance(lyric, Exception):
+                    failed.append(song_id)
+                else:
+                    fetched[song_id] = lyric
+            if failed:
+                logger.error(f"Failed to get lyrics for songs {failed}")
+            await async_lyric.set_lyrics(fetched)
+            lyrics.update(fetched)
+
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        taken = set()
+        files = []
+        jobs = []
+        for song in playlist.tracks:
+            if song.id not in cached and song.id not in lyrics:
+                continue
+            path = srt_filename(
+                directory,
+                safe_filename(f"{song.name} - {song.singer_name}"),
+                song.id,
+                taken,
+            )
+            if song.id in cached:
+                files.append((str(path), cached[song.id]))
+            elif lyrics[song.id]:
+                jobs.append((song.id, str(path), lyrics[song.id]))
+        exported = await asyncio.to_thread(write_files, files)
+
+        chunks = [jobs[i : i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+        if len(chunks) <= 1:
+            # not worth starting processes
+            rendered = await asyncio.to_thread(render_srt_files, jobs)
+        else:
+            loop = asyncio.get_running_loop()
+            with ProcessPoolExecutor(
+                max_workers=min(processes or os.cpu_count(), len(chunks)),
+                mp_context=multiprocessing.get_context("spawn"),
+            ) as pool:
+                results = await asyncio.gather(
+                    *(
+                        loop.run_in_executor(pool, render_srt_files, chunk)
+                        for chunk in chunks
+                    )
+                )
+            rendered = [render for result in results for render in result]
+        exported += sum(1 for _, srt in rendered if srt)
+        await async_lyric.set_rendered(
+            {song_id: (lyric_hash(lyrics[song_id]), srt) for song_id, srt in rendered},
+            "srt",
+            SRT_VERSION,
+        )
+
+        logger.info(
+            f"Exported {exported} lyrics of playlist {playlist.name} to {directory}: "
+            f"{len(files)} cached, {len(rendered)} rendered, {len(fetched)} fetched"
+        )
+        return {
+            "id": playlist_id,
+            "exported": exported,
+            "cached": len(files),
+            "rendered": len(rendered),
+            "fetched": len(fetched),
+            "without_lyric": len(song_ids) - exported,
+        }
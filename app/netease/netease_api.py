@@ -1,13 +1,27 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import os
 import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.netease.prepare_request import prepare_request
+from app.constants.env import (
+    netease_base_url,
+    netease_pool_size,
+    netease_timeout,
+    netease_max_retries,
+    netease_backoff_factor,
+    playlist_page_size,
+    song_detail_batch_size,
+    netease_api_concurrency,
+)
+from app.netease.prepare_request import KeyPool, prepare_request, key_pool
 from app.utils.log import logger
+from app.utils.metrics import add_bytes, span
 
 # Different quality levels
 quality_levels = {
@@ -16,11 +30,31 @@ quality_levels = {
     "lossless": {"level": "lossless", "br": 999000},
     "hires": {"level": "hires", "br": 999000},
 }
+# Best to worst, songs unavailable at a level are retried at the next one
+quality_ladder = ["hires", "lossless", "high", "standard"]
+# Quality name of a level returned by netease
+level_qualities = {params["level"]: name for name, params in quality_levels.items()}
+
+
+def fallback_qualities(quality: str) -> list[str]:
+    """quality followed by every lower rung of quality_ladder"""
+    if quality not in quality_ladder:
+        return [quality]
+    return quality_ladder[quality_ladder.index(quality) :]
 
 
 class NeteaseApi:
-    def __init__(self, cookie_file: str):
+    def __init__(
+        self,
+        cookie_file: str,
+        pool_size: int = netease_pool_size,
+        timeout: float = netease_timeout,
+        max_retries: int = netease_max_retries,
+        backoff_factor: float = netease_backoff_factor,
+        key_pool: KeyPool = key_pool,
+    ):
         self.cookie_content = self.read_cookie(cookie_file)
+        self.timeout = timeout
 
         self.headers = {
             "Content-Type": "application/x-www-form-urlencoded",
@@ -28,37 +62,116 @@ class NeteaseApi:
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
             "Origin": "https://music.163.com",
             "Cookie": self.cookie_content,
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
         }
 
+        # One pooled keep-alive session for every call, so requests reuse
+        # TCP+TLS connections to music.163.com instead of redoing handshakes
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            backoff_jitter=backoff_factor,
+            status_forcelist=(500, 502, 503, 504),
+            # weapi calls are all POST and only read data, retrying is safe
+            allowed_methods=None,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(self.headers)
+
+        # Precompute encryption keys while the first requests are being built
+        self.key_pool = key_pool
+        self.key_pool.fill_in_background()
+
+    def post(self, url: str, data: dict, stage: str = "netease.post") -> dict:
+        """
+        Encrypt data and POST it to a weapi url, returning the json body.
+        Raises requests.HTTPError if the status is still an error once the
+        retries are spent. stage names the call in metrics.
+        """
+        with span("netease.encrypt"):
+            encrypted = prepare_request(data, self.key_pool)
+        with span(stage):
+            response = self.session.post(url, data=encrypted, timeout=self.timeout)
+            add_bytes(stage, len(response.content))
+            # retries give up on a 5xx without raising, the body is an error page
+            response.raise_for_status()
+        return response.json()
+
     def get_playlist(self, playlist_id: str):
-        url = "https://music.163.com/weapi/v6/playlist/detail?csrf_token="
+        playlist = self.get_playlist_page(playlist_id, 0)
+        playlist_name = playlist.get("name", "")
+        playlist_description = playlist.get("description", "")
+        track_ids = self.get_playlist_track_ids(playlist_id, playlist)
+
+        return playlist_name, playlist_description, track_ids
+
+    def get_playlist_track_ids(self, playlist_id: str, first_page: dict) -> list:
+        """
+        All track ids of a playlist, given its first detail page.
+        Large playlists may not return every track id in one response,
+        keep paging until trackCount ids are collected
+        """
+        track_ids = [i["id"] for i in first_page.get("trackIds", [])]
+        track_count = first_page.get("trackCount", len(track_ids))
+        while len(track_ids) < track_count:
+            page = self.get_playlist_page(playlist_id, len(track_ids))
+            page_ids = [i["id"] for i in page.get("trackIds", [])]
+            if page_ids[:1] == track_ids[:1]:
+                # offset was ignored and the list restarted from the top
+                page_ids = page_ids[len(track_ids) :]
+            if not page_ids:
+                break
+            track_ids.extend(page_ids)
+        if len(track_ids) < track_count:
+            logger.warning(
+                f"Playlist {playlist_id} has {track_count} tracks, only got {len(track_ids)} track ids"
+            )
+        return track_ids
+
+    def get_playlist_page(self, playlist_id: str, offset: int):
+        url = f"{netease_base_url}/weapi/v6/playlist/detail?csrf_token="
         playlist_data = {
             "csrf_token": "",
             "id": playlist_id,
-            "offset": 0,
+            "offset": offset,
             "total": True,
-            "limit": 1000,
-            "withSongs": True,
-            "n": 1000,
+            "limit": playlist_page_size,
+            # only trackIds are used, skip the song details in the response
+            "n": 0,
         }
-        encrypted = prepare_request(playlist_data)
-        response = requests.post(url, data=encrypted, headers=self.headers)
-        playlist = response.json().get("playlist", {})
-        playlist_name = playlist.get("name", "")
-        playlist_description = playlist.get("description", "")
-        track_ids = [i["id"] for i in playlist.get("trackIds", [])]
-
-        return playlist_name, playlist_description, track_ids
+        return self.post(url, playlist_data, "netease.playlist").get("playlist", {})
 
     def get_songs(self, song_ids: list[str]):
         """
-        Get details for multiple songs by their IDs
+        Get details for multiple songs by their IDs.
+        Ids are requested in batches of song_detail_batch_size, up to
+        netease_api_concurrency batches at a time.
         Args:
             song_ids (list): List of song IDs
         Returns:
-            dict: The response containing songs information
+            list: Song details, in the order of song_ids
         """
-        url = "https://music.163.com/weapi/v3/song/detail?csrf_token="
+        batches = [
+            song_ids[i : i + song_detail_batch_size]
+            for i in range(0, len(song_ids), song_detail_batch_size)
+        ]
+        if len(batches) <= 1:
+            return self.get_songs_batch(song_ids) if song_ids else []
+
+        with ThreadPoolExecutor(max_workers=netease_api_concurrency) as executor:
+            results = list(executor.map(self.get_songs_batch, batches))
+        songs = {song["id"]: song for batch in results for song in batch}
+        return [songs[id] for id in song_ids if id in songs]
+
+    def get_songs_batch(self, song_ids: list[str]):
+        url = f"{netease_base_url}/weapi/v3/song/detail?csrf_token="
 
         # Format the song IDs into the required structure
         c = []
@@ -71,12 +184,10 @@ class NeteaseApi:
             "csrf_token": "",
         }
 
-        encrypted = prepare_request(data)
-        response = requests.post(url, data=encrypted, headers=self.headers)
-        return response.json().get("songs", [])
+        return self.post(url, data, "netease.song_detail").get("songs", [])
 
     def get_lyric(self, song_id):
-        url = "https://music.163.com/weapi/song/lyric?csrf_token="
+        url = f"{netease_base_url}/weapi/song/lyric?csrf_token="
 
         data = {
             "id": song_id,
@@ -87,72 +198,7 @@ class NeteaseApi:
             "csrf_token": "",
         }
 
-        encrypted = prepare_request(data)
-
-        response = requests.post(url, data=encrypted, headers=self.headers)
-        return response.json().get("lrc", {}).get("lyric", "")
-
-    def convert_timestamp(self, lrc_time):
-        """Convert [mm:ss.ms] to SRT format HH:MM:SS,mmm"""
-        # Remove brackets
-        time_str = lrc_time[1:-1]
-
-        # Split minutes and seconds
-        minutes, seconds = time_str.split(":")
-
-        # Convert to integers/float
-        minutes = int(minutes)
-        seconds = float(seconds)
-
-        # Calculate hours, minutes, seconds, milliseconds
-        hours = minutes // 60
-        minutes = minutes % 60
-        whole_seconds = int(seconds)
-        milliseconds = int((seconds - whole_seconds) * 1000)
-
-        return f"{hours:02d}:{minutes:02d}:{whole_seconds:02d},{milliseconds:03d}"
-
-    def lrc_to_srt(self, lrc_text):
-        # Split into lines and filter empty lines
-        lines = [line for line in lrc_text.split("\n") if line.strip()]
-
-        srt_lines = []
-        counter = 1
-
-        for i, line in enumerate(lines):
-            # Skip lines without proper timestamp
-            if not line.startswith("[") or "]" not in line:
-                continue
-
-            # Extract timestamp and text
-            timestamp = line[:10]  # Get [mm:ss.mmm]
-            text = line[11:].strip()
-
-            # Convert current timestamp
-            start_time = self.convert_timestamp(timestamp)
-
-            # Get end time from next line or add 5 seconds if it's the last line
-            if i + 1 < len(lines) and lines[i + 1].startswith("["):
-                end_timestamp = lines[i + 1][:10]
-                end_time = self.convert_timestamp(end_timestamp)
-            else:
-                # For the last line, add 5 seconds
-                hours, minutes, rest = start_time.split(":")
-                seconds, ms = rest.split(",")
-                # Convert string to int for minutes and seconds
-                minutes = int(minutes)
-                new_seconds = int(seconds) + 5
-                if new_seconds >= 60:
-                    minutes = minutes + (new_seconds // 60)
-                    new_seconds = new_seconds % 60
-                end_time = f"{hours}:{minutes:02d}:{new_seconds:02d},{ms}"
-
-            # Create SRT entry
-            srt_entry = f"{counter}\n{start_time} --> {end_time}\n{text}\n"
-            srt_lines.append(srt_entry)
-            counter += 1
-
-        return "\n".join(srt_lines)
+        return self.post(url, data, "netease.lyric").get("lrc", {}).get("lyric", "")
 
     def read_cookie(self, cookie_file: str) -> None:
         """
@@ -185,7 +231,7 @@ class NeteaseApi:
 
     # Example: Get high quality URLs
     def get_songs_url_with_quality(self, song_ids, quality="lossless"):
-        url = "https://music.163.com/weapi/song/enhance/player/url/v1?csrf_token="
+        url = f"{netease_base_url}/weapi/song/enhance/player/url/v1?csrf_token="
 
         quality_params = quality_levels.get(quality, quality_levels["lossless"])
 
@@ -197,6 +243,4 @@ class NeteaseApi:
             "br": quality_params["br"],
         }
 
-        encrypted = prepare_request(data)
-        response = requests.post(url, data=encrypted, headers=self.headers)
-        return response.json().get("data", [])
+        return self.post(url, data, "netease.song_url").get("data", [])
@@ -2,14 +2,23 @@ import json
 import random
 import string
 import base64
+import threading
+import time
+from collections import deque
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import pad
 
+from app.constants.env import weapi_key_max_uses, weapi_key_ttl
+
 MODULUS = "00e0b509f6259df8642dbc35662901477df22677ec152b5ff68ace615bb7b725152b3ab17a876aea8a5aa76d2e417629ec4ee341f56135fccf695280104e0312ecbda92557c93870114af6c9d05c4f7f0c3685b7a46bee255932575cce10b424d813cfe4875d3e82047b97ddef52741d546b8e289dc6935b3ece0462db0a22b8e7"
 NONCE = "0CoJUm6Qyw8W8jud"
 PUBKEY = "010001"
 VI = "0102030405060708"
 
+MODULUS_INT = int(MODULUS, 16)
+PUBKEY_INT = int(PUBKEY, 16)
+IV_BYTES = bytes(VI, "utf-8")
+
 
 def create_secret_key(length):
     """Generate random string of specified length"""
@@ -19,11 +28,10 @@ def create_secret_key(length):
 
 def aes_encrypt(text, key):
     """AES encrypt the text with given key"""
-    iv = bytes(VI, "utf-8")
     text = text.encode("utf-8")
     pad_text = pad(text, AES.block_size)
 
-    cipher = AES.new(key.encode("utf-8"), AES.MODE_CBC, iv)
+    cipher = AES.new(key.encode("utf-8"), AES.MODE_CBC, IV_BYTES)
     encrypted = cipher.encrypt(pad_text)
     return base64.b64encode(encrypted).decode("utf-8")
 
@@ -31,25 +39,104 @@ def aes_encrypt(text, key):
 def rsa_encode(text):
     """RSA encrypt (just like the C# RSAEncode)"""
     text = text[::-1]  # reverse string
-    rs = pow(int(text.encode("utf-8").hex(), 16), int(PUBKEY, 16), int(MODULUS, 16))
+    rs = pow(int(text.encode("utf-8").hex(), 16), PUBKEY_INT, MODULUS_INT)
     return format(rs, "x").zfill(256)
 
 
-def prepare_request(data):
+class KeyPool:
+    """
+    Pool of precomputed (secret_key, encSecKey) pairs.
+
+    The RSA step only depends on the secret key, so pairs can be generated
+    ahead of time and handed out as requests are prepared. By default every
+    pair is used once, like a fresh key per request. That only moves the
+    RSA step off the request path, under sustained load every request still
+    pays for one. max_uses and ttl allow a pair to be reused for a number
+    of requests or a number of seconds, which is what saves CPU.
+    """
+
+    def __init__(self, size: int = 64, max_uses: int = 1, ttl: float = None):
+        self.size = size
+        self.max_uses = max_uses
+        self.ttl = ttl
+        self._keys = deque()
+        self._lock = threading.Lock()
+        self._current = None
+        self._current_uses = 0
+        self._current_created = 0.0
+        self._refilling = False
+
+    def fill(self):
+        """Generate pairs until the pool is full"""
+        while len(self._keys) < self.size:
+            self._keys.append(self._generate())
+
+    def fill_in_background(self):
+        with self._lock:
+            if self._refilling:
+                return
+            self._refilling = True
+        threading.Thread(target=self._refill, daemon=True).start()
+
+    def acquire(self) -> tuple[str, str]:
+        with self._lock:
+            if self._current is not None and self._usable():
+                self._current_uses += 1
+                return self._current
+            key = self._keys.popleft() if self._keys else None
+            low = len(self._keys) < self.size // 2
+        if low:
+            self.fill_in_background()
+        if key is None:
+            # Pool ran dry, pay for this pair inline
+            key = self._generate()
+        with self._lock:
+            self._current = key
+            self._current_uses = 1
+            self._current_created = time.monotonic()
+        return key
+
+    def _usable(self) -> bool:
+        if self._current_uses >= self.max_uses:
+            return False
+        if self.ttl is not None:
+            return time.monotonic() - self._current_created < self.ttl
+        return True
+
+    def _refill(self):
+        try:
+            self.fill()
+        finally:
+            with self._lock:
+                self._refilling = False
+
+    @staticmethod
+    def _generate() -> tuple[str, str]:
+        secret_key = create_secret_key(16)
+        return secret_key, rsa_encode(secret_key)
+
+
+# Shared by every NeteaseApi in the process
+key_pool = KeyPool(max_uses=weapi_key_max_uses, ttl=weapi_key_ttl or None)
+
+
+def prepare_request(data, pool: KeyPool = key_pool):
     """Prepare the encrypted request parameters"""
-    secret_key = create_secret_key(16)
+    secret_key, enc_sec_key = pool.acquire()
 
     # First AES encryption
     params = aes_encrypt(json.dumps(data), NONCE)
     # Second AES encryption
     params = aes_encrypt(params, secret_key)
 
-    # RSA encryption for key
-    enc_sec_key = rsa_encode(secret_key)
-
     return {"params": params, "encSecKey": enc_sec_key}
 
 
+def prepare_requests(data_list: list, pool: KeyPool = key_pool) -> list[dict]:
+    """Prepare the encrypted request parameters for a batch of payloads"""
+    return [prepare_request(data, pool) for data in data_list]
+
+
 if __name__ == "__main__":
 
     # Example usage for playlist
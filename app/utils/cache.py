@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable, Optional
+
+from app.constants.env import (
+    song_cache_size,
+    song_cache_ttl,
+    url_cache_size,
+    minio_url_ttl,
+    netease_url_ttl,
+)
+from app.utils.metrics import metrics
+
+
+class TTLCache:
+    """
+    Thread-safe in-memory cache with LRU eviction once maxsize entries are
+    held. Every entry expires ttl seconds after it is set, unless a ttl is
+    given for that entry.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate_many(self, keys: Iterable[Hashable]):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._data),
+        }
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# Song documents without lyrics, keyed by song id
+song_cache = TTLCache("song", song_cache_size, song_cache_ttl)
+# Presigned MinIO download urls, keyed by (bucket name, song id)
+minio_url_cache = TTLCache("minio_url", url_cache_size, minio_url_ttl)
+# Netease stream url entries, keyed by (song id, quality)
+netease_url_cache = TTLCache("netease_url", url_cache_size, netease_url_ttl)
+# MinIO objects known to exist, keyed by (bucket name, object name)
+minio_object_cache = TTLCache("minio_object", url_cache_size, minio_url_ttl)
+
+
+def cache_stats() -> dict:
+    return {
+        cache.name: cache.stats()
+        for cache in (
+            song_cache,
+            minio_url_cache,
+            netease_url_cache,
+            minio_object_cache,
+        )
+    }
+
+
+def cache_samples(stats: dict) -> list[tuple]:
+    """
+    Metrics samples of {cache name: stats}: hits and misses as counters,
+    the rest (entries, bytes) as gauges
+    """
+    samples = []
+    for name, values in stats.items():
+        for key, value in values.items():
+            if key in ("hits", "misses"):
+                samples.append(
+                    ("counter", f"cache_{key}_total", {"cache": name}, value)
+                )
+            else:
+                # size is the number of entries
+                key = "entries" if key == "size" else key
+                samples.append(("gauge", f"cache_{key}", {"cache": name}, value))
+    return samples
+
+
+metrics.register(lambda: cache_samples(cache_stats()))
@@ -0,0 +1,239 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from functools import cache
+from pathlib import Path
+from typing import Iterable, Optional
+
+from app.constants.env import local_cache_dir, local_cache_max_bytes, local_cache_policy
+from app.utils.cache import cache_samples
+from app.utils.log import logger
+from app.utils.metrics import metrics
+
+INDEX_NAME = "index.json"
+
+
+class DiskCache:
+    """
+    Size-capped cache of files in one directory, keyed by song id.
+
+    The index (file, size, md5, mtime, hits and last use of each entry) is
+    kept in index.json beside the files, replaced atomically and merged
+    with what other processes sharing the directory wrote. Only files put
+    into the cache are indexed; anything else in the directory is never
+    served, evicted or deleted.
+
+    Once the indexed files take more than max_bytes (0 for no cap) the least
+    recently used, or with policy "lfu" the least often used, are deleted.
+    Files put or hit by the current call are never evicted by it, so one
+    large batch may exceed the cap until the next one.
+    """
+
+    def __init__(self, directory, max_bytes: int, policy: str = "lru"):
+        if policy not in ("lru", "lfu"):
+            raise ValueError(f"unknown eviction policy {policy}")
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.hits = 0
+        self.misses = 0
+        self._entries: dict[str, dict] = {}
+        # keys dropped since the last save, not to be merged back
+        self._removed: set[str] = set()
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._index = self.directory / INDEX_NAME
+        self.load()
+
+    @property
+    def size(self) -> int:
+        return sum(entry["size"] for entry in self._entries.values())
+
+    def path_for(self, filename: str) -> Path:
+        return self.directory / filename
+
+    def get(
+        self, key, size: int = 0, md5: Optional[str] = None
+    ) -> Optional[tuple[Path, str]]:
+        """
+        Path and md5 of a cached file, None on a miss. The file must still
+        have the size and mtime it was cached with, and the size and md5
+        given, if any. A file that does not is dropped. A file put without
+        an md5 is a miss unless md5 is given.
+        """
+        key = str(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            path = entry and self._valid(key, entry, size, md5)
+            if not path:
+                self.misses += 1
+                return None
+            entry["hits"] += 1
+            entry["used"] = time.time()
+            self.hits += 1
+            self._dirty = True
+            return path, entry["md5"]
+
+    def put(self, key, path: Path, size: int, md5: Optional[str] = None):
+        """Add a file written into the directory"""
+        stat = path.stat()
+        with self._lock:
+            key = str(key)
+            old = self._entries.get(key)
+            if old and old["file"] != path.name:
+                # same song in another format, keep only the newest
+                self.path_for(old["file"]).unlink(missing_ok=True)
+            self._entries[key] = {
+                "file": path.name,
+                "size": size,
+                "md5": md5.lower() if md5 else None,
+                "mtime": stat.st_mtime_ns,
+                "hits": old["hits"] if old else 0,
+                "used": time.time(),
+            }
+            self._removed.discard(key)
+            self._dirty = True
+
+    def evict(self, protect: Iterable = ()) -> list[str]:
+        """Delete files until the cache fits max_bytes, returns their keys"""
+        if not self.max_bytes:
+            return []
+        protect = {str(key) for key in protect}
+        with self._lock:
+            total = self.size
+            if total <= self.max_bytes:
+                return []
+            if self.policy == "lfu":
+                order = lambda item: (item[1]["hits"], item[1]["used"])
+            else:
+                order = lambda item: item[1]["used"]
+            evicted = []
+            for key, entry in sorted(self._entries.items(), key=order):
+                if total <= self.max_bytes:
+                    break
+                if key in protect:
+                    continue
+                self._drop(key)
+                total -= entry["size"]
+                evicted.append(key)
+        if evicted:
+            logger.info(
+                "Evicted {} files from {}, {} bytes left",
+                len(evicted),
+                self.directory,
+                total,
+            )
+        return evicted
+
+    def load(self):
+        """Read the index"""
+        entries = self._read_index()
+        with self._lock:
+            self._entries = entries
+
+    def save(self):
+        """
+        Write the index if anything changed. Entries another process added
+        since it was read are kept, as long as their file is still there.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            for key, entry in self._read_index().items():
+                if key not in self._entries and key not in self._removed:
+                    if self.path_for(entry["file"]).exists():
+                        self._entries[key] = entry
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp = self._index.with_name(f"{INDEX_NAME}.{os.getpid()}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"entries": self._entries}, f)
+            os.replace(tmp, self._index)
+            self._removed.clear()
+            self._dirty = False
+
+    def stats(self) -> dict:
+        # also read by the metrics exporter's thread
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "bytes": self.size,
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _valid(self, key: str, entry: dict, size: int, md5: Optional[str]):
+        path = self.path_for(entry["file"])
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            self._drop(key)
+            return None
+        if stat.st_size != entry["size"] or stat.st_mtime_ns != entry["mtime"]:
+            # changed behind the cache's back
+            self._drop(key)
+            return None
+        if size and size != entry["size"]:
+            self._drop(key)
+            return None
+        if md5:
+            if entry["md5"] is None:
+                # put without one, hashed once
+                entry["md5"] = _file_md5(path)
+                self._dirty = True
+            if entry["md5"] != md5.lower():
+                self._drop(key)
+                return None
+        elif entry["md5"] is None:
+            # nothing to tell a complete file from a truncated one
+            return None
+        return path
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key)
+        self.path_for(entry["file"]).unlink(missing_ok=True)
+        self._removed.add(key)
+        self._dirty = True
+
+    def _read_index(self) -> dict:
+        try:
+            with open(self._index, "r", encoding="utf-8") as f:
+                return json.load(f)["entries"]
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Ignoring unreadable cache index {self._index}: {e}")
+            return {}
+
+
+def _file_md5(path: Path) -> str:
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+_build_lock = threading.Lock()
+
+
+def get_disk_cache() -> Optional[DiskCache]:
+    """
+    Audio files kept on local disk, None when the tier is turned off.
+    Built on first use, which reads the index, so call it off the event loop.
+    """
+    with _build_lock:
+        return _disk_cache()
+
+
+@cache
+def _disk_cache() -> Optional[DiskCache]:
+    if not local_cache_dir:
+        return None
+    disk_cache = DiskCache(local_cache_dir, local_cache_max_bytes, local_cache_policy)
+    metrics.register(lambda: cache_samples({"disk": disk_cache.stats()}))
+    return disk_cache
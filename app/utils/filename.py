@@ -0,0 +1,6 @@
+import re
+
+
+def safe_filename(name: str) -> str:
+    """name without characters that are not allowed in file names"""
+    return re.sub(r'[\x00-\x1f/\\:*?"<>|]', "_", name).strip(" .") or "untitled"
@@ -1,12 +1,18 @@
+from datetime import datetime
 from pathlib import Path
 from sys import stdout
 from loguru import logger
 
 import os
+import queue
 import sys
+import threading
+import time
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from app.constants.env import log_background, log_level, log_sample_every
+
 
 def log_formatter(record: dict) -> str:
     """
@@ -26,8 +32,133 @@ def log_formatter(record: dict) -> str:
     return f"<fg #70acde>{{time:YYYY-MM-DD HH:mm:ss}}</fg #70acde> | <fg {color}>{{level}}</fg {color}>: <light-white>{{message}}</light-white>\n"
 
 
-# Remove all existing handlers
-logger.remove()
-# Add a standard console handler
-logger.add(stdout, colorize=True, format=log_formatter)
-logger.add(Path("logs/story.log"), rotation="10 MB", retention="10 days")
+class RotatingFile:
+    """
+    Log file stream, opened on the first write. Once it reaches max_bytes
+    it is renamed with a timestamp and a new one started, and rotated files
+    older than retention seconds are deleted. Stands in for loguru's file
+    sink, which can't be handed to BackgroundSink.
+    """
+
+    def __init__(self, path, max_bytes: int, retention: float):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.retention = retention
+        self._file = None
+        self._size = 0
+
+    def write(self, message: str):
+        if self._file is None:
+            self._open()
+        elif self._size + len(message) > self.max_bytes:
+            self._rotate()
+        self._file.write(message)
+        self._size += len(message)
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def stop(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._size = self._file.tell()
+
+    def _rotate(self):
+        self._file.close()
+        stamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S_%f")
+        self.path.rename(
+            self.path.with_name(f"{self.path.stem}.{stamp}{self.path.suffix}")
+        )
+        self._open()
+        expired = time.time() - self.retention
+        for old in self.path.parent.glob(f"{self.path.stem}.*{self.path.suffix}"):
+            if old.stat().st_mtime < expired:
+                old.unlink(missing_ok=True)
+
+
+class BackgroundSink:
+    """
+    Stream sink that hands formatted records to a writer thread, so a
+    stream that blocks (e.g. stdout piped to a slow reader, or a log file
+    on a busy disk) never stalls the caller. loguru's own enqueue pickles
+    every record through a multiprocessing queue, which costs more than
+    the write it saves.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, message: str):
+        self._queue.put(message)
+
+    def stop(self):
+        # called by logger.remove(), which loguru also runs at exit
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+        if callable(getattr(self._stream, "stop", None)):
+            self._stream.stop()
+
+    def _run(self):
+        while True:
+            message = self._queue.get()
+            if message is None:
+                return
+            self._stream.write(message)
+            self._stream.flush()
+
+
+class SampledLog:
+    """
+    Log for messages repeated for every item of a batch.
+
+    One in every `every` items is logged at INFO and the rest at DEBUG, so
+    large batches don't flood the sinks, and summary logs how many items
+    the batch had. Messages use loguru's {} style arguments, which are only
+    formatted when the record is emitted.
+    """
+
+    def __init__(self, name: str, every: int = log_sample_every):
+        self.name = name
+        self.every = every
+        self.count = 0
+
+    def item(self, message: str, *args):
+        self.count += 1
+        if self.every and (self.count - 1) % self.every == 0:
+            logger.opt(depth=1).info(message, *args)
+        else:
+            logger.opt(depth=1).debug(message, *args)
+
+    def summary(self, message: str = "", *args):
+        logger.opt(depth=1).info(
+            f"{self.name}: {self.count} items" + (f", {message}" if message else ""),
+            *args,
+        )
+
+
+def configure(console=stdout):
+    """
+    Set up the sinks, replacing any existing ones. console is the stream of
+    the console log, pass stderr when stdout carries data.
+    """
+    # Remove all existing handlers
+    logger.remove()
+    # The file is opened on the first message rather than at import
+    story = RotatingFile("logs/story.log", 10 * 1024**2, 10 * 24 * 3600)
+    if log_background:
+        console, story = BackgroundSink(console), BackgroundSink(story)
+    # Add a standard console handler
+    logger.add(console, colorize=True, format=log_formatter, level=log_level)
+    logger.add(story, colorize=False, level=log_level)
+
+
+configure()
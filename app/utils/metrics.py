@@ -0,0 +1,370 @@
+import atexit
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import nullcontext
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterable, Optional
+
+from app.constants.env import (
+    metrics_dump_interval,
+    metrics_dump_path,
+    metrics_enabled,
+    metrics_port,
+    metrics_span_buffer,
+)
+from app.utils.log import logger
+
+PREFIX = "music_playlist"
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        # the last bucket is +Inf
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket the q quantile falls in"""
+        seen = 0
+        for bound, count in zip(BUCKETS + (float("inf"),), self.counts):
+            seen += count
+            if seen and seen >= q * self.count:
+                return bound
+        return None
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters and latency histograms, keyed by name
+    and labels, and of the most recent traced spans.
+
+    Collectors add counters and gauges kept elsewhere (e.g. cache hit
+    counts), read at every export.
+    """
+
+    def __init__(self, span_buffer: int = metrics_span_buffer):
+        self.counters: dict[tuple, float] = {}
+        self.histograms: dict[tuple, Histogram] = {}
+        self.spans = deque(maxlen=span_buffer)
+        self.collectors: list[Callable[[], Iterable[tuple]]] = []
+        self._lock = threading.Lock()
+
+    def register(self, collector: Callable[[], Iterable[tuple]]):
+        """
+        Add a collector returning (kind, name, labels, value) samples, kind
+        being "counter" or "gauge" and labels a dict
+        """
+        with self._lock:
+            self.collectors.append(collector)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def finish(self, span: "Span", seconds: float, ok: bool):
+        self.observe("stage_seconds", seconds, stage=span.stage)
+        self.inc("stage_calls_total", stage=span.stage, status="ok" if ok else "error")
+        if span.ids:
+            # deque appends are atomic, no lock needed
+            self.spans.append(
+                {
+                    "stage": span.stage,
+                    "ids": span.ids,
+                    "parent": span.parent.stage if span.parent else None,
+                    "at": round(span.wall_start, 3),
+                    "ms": round(seconds * 1000, 3),
+                    "ok": ok,
+                }
+            )
+
+    def clear(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.spans.clear()
+
+    def collect(self) -> tuple[list, list]:
+        """Counters and gauges of the collectors, as ((name, labels), value)"""
+        with self._lock:
+            collectors = list(self.collectors)
+        counters = []
+        gauges = []
+        for collector in collectors:
+            for kind, name, labels, value in collector():
+                sample = ((name, tuple(sorted(labels.items()))), value)
+                (counters if kind == "counter" else gauges).append(sample)
+        return counters, gauges
+
+    def snapshot(self) -> dict:
+        collected, gauges = self.collect()
+        with self._lock:
+            counters = list(self.counters.items()) + collected
+            histograms = [
+                (key, histogram.count, histogram.sum, list(histogram.counts), histogram)
+                for key, histogram in self.histograms.items()
+            ]
+        return {
+            "pid": os.getpid(),
+            "time": time.time(),
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in counters
+            ],
+            "gauges": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in gauges
+            ],
+            "histograms": [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": count,
+                    "sum": round(total, 6),
+                    "p50": histogram.quantile(0.5),
+                    "p99": histogram.quantile(0.99),
+                    "buckets": dict(zip(map(str, BUCKETS + ("+Inf",)), counts)),
+                }
+                for (name, labels), count, total, counts, histogram in histograms
+            ],
+            "spans": list(self.spans),
+        }
+
+    def prometheus(self) -> str:
+        """
+        Counters, gauges and histograms in the Prometheus text exposition
+        format
+        """
+        collected, gauges = self.collect()
+        with self._lock:
+            counters = sorted(list(self.counters.items()) + collected)
+            histograms = sorted(
+                (key, histogram.count, histogram.sum, list(histogram.counts))
+                for key, histogram in self.histograms.items()
+            )
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {PREFIX}_{name} counter")
+            lines.append(f"{PREFIX}_{name}{_labels(labels)} {value}")
+        for (name, labels), value in sorted(gauges):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {PREFIX}_{name} gauge")
+            lines.append(f"{PREFIX}_{name}{_labels(labels)} {value}")
+        for (name, labels), count, total, counts in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {PREFIX}_{name} histogram")
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS + ("+Inf",), counts):
+                cumulative += bucket
+                le = _labels(labels + (("le", bound),))
+                lines.append(f"{PREFIX}_{name}_bucket{le} {cumulative}")
+            lines.append(f"{PREFIX}_{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{PREFIX}_{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+metrics = Metrics()
+_current_span: ContextVar[Optional["Span"]] = ContextVar("span", default=None)
+_null_span = nullcontext()
+
+
+class Span:
+    """
+    Times one stage and records it in the stage_seconds histogram.
+
+    ids (e.g. playlist_id, song_id) tie the stage to what it worked on and
+    are inherited by the spans opened inside it, in the same thread, task
+    or asyncio.to_thread call. Spans carrying ids are kept in the snapshot.
+    """
+
+    __slots__ = ("stage", "ids", "parent", "start", "wall_start", "_token")
+
+    def __init__(self, stage: str, ids: dict):
+        self.stage = stage
+        self.ids = ids
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        if self.parent and self.parent.ids:
+            self.ids = {**self.parent.ids, **self.ids}
+        self._token = _current_span.set(self)
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        _current_span.reset(self._token)
+        metrics.finish(self, seconds, exc_type is None)
+        return False
+
+
+def span(stage: str, **ids):
+    """Context manager timing a stage, a shared no-op when metrics are off"""
+    if not metrics_enabled:
+        return _null_span
+    return Span(stage, ids)
+
+
+def timed(stage: str, trace: str = None):
+    """
+    Decorator running every call of a function or coroutine function in a
+    span. trace names an argument whose value is recorded as the span id.
+    With metrics off the function is returned as is and costs nothing.
+    """
+
+    def decorator(fn):
+        if not metrics_enabled:
+            return fn
+        position = None
+        if trace:
+            position = list(inspect.signature(fn).parameters).index(trace)
+
+        def ids(args, kwargs) -> dict:
+            if trace is None:
+                return {}
+            if trace in kwargs:
+                return {trace: kwargs[trace]}
+            return {trace: args[position]} if position < len(args) else {}
+
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with Span(stage, ids(args, kwargs)):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with Span(stage, ids(args, kwargs)):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record(stage: str, seconds: float):
+    """Add a duration measured by the caller to a stage's histogram"""
+    if metrics_enabled:
+        metrics.observe("stage_seconds", seconds, stage=stage)
+
+
+def add_bytes(stage: str, size: int):
+    if metrics_enabled and size:
+        metrics.inc("stage_bytes_total", size, stage=stage)
+
+
+def dump(path: str):
+    """Write the JSON snapshot to path, replacing it atomically"""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(metrics.snapshot(), f, default=str)
+    os.replace(tmp, path)
+
+
+def serve(port: int) -> ThreadingHTTPServer:
+    """Serve /metrics and /metrics.json from a background thread"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body = metrics.prometheus().encode()
+                content_type = "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body = json.dumps(metrics.snapshot(), default=str).encode()
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_exporters():
+    """Start the endpoint and the periodic dump configured in env"""
+    if not metrics_enabled:
+        return
+    if metrics_port:
+        try:
+            serve(metrics_port)
+            logger.info(f"Serving metrics on port {metrics_port}")
+        except OSError as e:
+            # e.g. a second worker process on the same host
+            logger.warning(f"Metrics endpoint not started on {metrics_port}: {e}")
+    if metrics_dump_path:
+        path = metrics_dump_path.format(pid=os.getpid())
+
+        def run():
+            while True:
+                time.sleep(metrics_dump_interval)
+                dump(path)
+
+        threading.Thread(target=run, daemon=True).start()
+        atexit.register(dump, path)
+        logger.info(f"Dumping metrics to {path} every {metrics_dump_interval}s")
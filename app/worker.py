@@ -0,0 +1,230 @@
+import asyncio
+import multiprocessing
+import os
+import socket
+import sys
+import uuid
+
+from pymongo.errors import PyMongoError
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.constants.env import (
+    job_heartbeat_interval,
+    job_lease_seconds,
+    job_poll_interval,
+    job_song_batch_size,
+    worker_processes,
+)
+from app.mongodb.job import (
+    claim_job,
+    complete_job,
+    enqueue_jobs,
+    fail_job,
+    heartbeat,
+    job_record,
+)
+from app.mongodb import async_lyric, async_playlist, async_song
+from app.mongodb.async_client import close_async_client
+from app.netease.main import Netease
+from app.utils.log import logger
+from app.utils.metrics import span, start_exporters
+
+
+class Worker:
+    """
+    Pulls jobs from the Mongo queue and runs them through Netease.
+
+    Job kinds:
+        playlist: {"playlist_id"} syncs the playlist and, if it changed,
+                  enqueues song jobs for its tracks without stored audio in
+                  batches of job_song_batch_size, and with "lyrics" lyric
+                  jobs for those without a stored lyric
+        song:     {"song_ids", "quality"} mirrors the songs into MinIO
+        lyric:    {"song_id"} stores the lyric of a song
+
+    While a job runs its lease is renewed every job_heartbeat_interval
+    seconds. If the lease is lost to another worker the job is cancelled.
+    """
+
+    def __init__(self, cookie_file: str, name: str = None):
+        self.netease = Netease(cookie_file)
+        self.name = (
+            name or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        )
+        self.handlers = {
+            "playlist": self.run_playlist,
+            "song": self.run_song,
+            "lyric": self.run_lyric,
+        }
+        self._stopping = False
+
+    def stop(self):
+        self._stopping = True
+
+    async def run(self, max_jobs: int = None):
+        """Process jobs until stopped, or until max_jobs have been run"""
+        logger.info(f"Worker {self.name} started")
+        processed = 0
+        try:
+            while not self._stopping and (max_jobs is None or processed < max_jobs):
+                try:
+                    job = await asyncio.to_thread(claim_job, self.name)
+                    if job is None:
+                        await asyncio.sleep(job_poll_interval)
+                        continue
+                    await self.process(job)
+                except PyMongoError as e:
+                    # A job whose state could not be written is claimed again
+                    # once its lease expires
+                    logger.error(f"Worker {self.name} lost the job queue: {e!r}")
+                    await asyncio.sleep(job_poll_interval)
+                    continue
+                processed += 1
+        finally:
+            await close_async_client()
+        logger.info(f"Worker {self.name} stopped after {processed} jobs")
+
+    async def process(self, job: dict):
+        job_id, kind = job["_id"], job["kind"]
+        if job["attempts"] > job["max_attempts"]:
+            # Claimed again after lease expiries, most likely it kills workers
+            await asyncio.to_thread(
+                fail_job, job, self.name, "lease expired too many times"
+            )
+            logger.error(f"Job {kind} {job_id} dead-lettered after lease expiries")
+            return
+        handler = self.handlers.get(kind)
+        if handler is None:
+            # no attempt can succeed, don't retry it
+            await asyncio.to_thread(
+                fail_job, job, self.name, f"unknown kind {kind}", retry=False
+            )
+            logger.error(f"Job {kind} {job_id} dead-lettered, unknown kind")
+            return
+
+        logger.info(f"Running job {kind} {job_id} attempt {job['attempts']}")
+
+        async def run():
+            # stages of the job are traced to it
+            with span(f"job.{kind}", job_id=str(job_id)):
+                return await handler(job["payload"])
+
+        task = asyncio.ensure_future(run())
+        beat = asyncio.ensure_future(self._heartbeat(job_id, task))
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            if not beat.done():
+                # the worker itself is being cancelled
+                raise
+            logger.warning(f"Job {kind} {job_id} lost its lease, abandoned")
+            return
+        except Exception as e:
+            status = await asyncio.to_thread(fail_job, job, self.name, repr(e))
+            logger.error(f"Job {kind} {job_id} failed, now {status}: {e!r}")
+            return
+        finally:
+            beat.cancel()
+        if await asyncio.to_thread(complete_job, job_id, self.name, result):
+            logger.info(f"Job {kind} {job_id} done")
+        else:
+            logger.warning(
+                f"Job {kind} {job_id} finished after losing its lease, "
+                "result not recorded"
+            )
+
+    async def _heartbeat(self, job_id, task: asyncio.Task):
+        while True:
+            await asyncio.sleep(job_heartbeat_interval)
+            try:
+                held = await asyncio.to_thread(
+                    heartbeat, job_id, self.name, job_lease_seconds
+                )
+            except Exception as e:
+                # keep beating, the lease outlasts a few missed beats
+                logger.warning(f"Heartbeat of job {job_id} failed: {e!r}")
+                continue
+            if not held:
+                task.cancel()
+                return
+
+    async def run_playlist(self, payload: dict) -> dict:
+        playlist_id = payload["playlist_id"]
+        changes = await self.netease.sync_playlist_async(playlist_id)
+        if not changes["changed"]:
+            return {"added": 0, "removed": 0, "jobs": 0}
+        playlist = await async_playlist.get_playlist(playlist_id)
+        track_ids = playlist.track_ids.tolist()
+        songs, _ = await async_song.get_songs(track_ids)
+        stored = {song.id for song in songs if song.audio}
+        # Songs of earlier syncs whose jobs failed are picked up again
+        pending = [id for id in track_ids if id not in stored]
+        quality = payload.get("quality", "lossless")
+        jobs = [
+            job_record(
+                "song",
+                {
+                    "song_ids": pending[i : i + job_song_batch_size],
+                    "quality": quality,
+                },
+            )
+            for i in range(0, len(pending), job_song_batch_size)
+        ]
+        if payload.get("lyrics"):
+            lyrics = await async_lyric.get_lyrics(track_ids)
+            jobs.extend(
+                job_record("lyric", {"song_id": id})
+                for id in track_ids
+                if id not in lyrics
+            )
+        await asyncio.to_thread(enqueue_jobs, jobs)
+        return {
+            "added": len(changes["added"]),
+            "removed": len(changes["removed"]),
+            "jobs": len(jobs),
+        }
+
+    async def run_song(self, payload: dict) -> dict:
+        results = await self.netease.download_song(
+            payload["song_ids"],
+            quality=payload.get("quality", "lossless"),
+            save_local=False,
+        )
+        failed = [result.song_id for result in results if not result.ok]
+        if failed:
+            # Retrying the job skips the songs that made it into MinIO
+            raise RuntimeError(f"failed to download songs {failed}")
+        return {"downloaded": len(results)}
+
+    async def run_lyric(self, payload: dict) -> dict:
+        lyric, _ = await self.netease.get_lyric_async(payload["song_id"])
+        return {"length": len(lyric)}
+
+
+def run_worker(cookie_file: str, max_jobs: int = None):
+    """Entry point of one worker process"""
+    start_exporters()
+    asyncio.run(Worker(cookie_file).run(max_jobs))
+
+
+def run_workers(
+    cookie_file: str, processes: int = worker_processes, max_jobs: int = None
+):
+    """
+    Run processes workers against the shared queue and wait for them.
+    Each process opens its own Mongo and MinIO clients.
+    """
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=run_worker, args=(cookie_file, max_jobs))
+        for _ in range(processes)
+    ]
+    for process in workers:
+        process.start()
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        for process in workers:
+            process.terminate()
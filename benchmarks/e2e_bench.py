@@ -0,0 +1,355 @@
+"""
+End-to-end benchmarks of the Netease facade, offline.
+
+music.163.com is replaced by the local FakeWeapi server. Mongo and MinIO are
+the local docker-compose services, with their own database and bucket
+(MONGO_DB_NAME and MINIO_BUCKET, both ending in -bench) that are wiped
+before every cold scenario.
+
+Scenarios:
+    sync_cold      sync a playlist into an empty db
+    sync_warm      sync a playlist that did not change
+    download_cold  download every track of the playlist into an empty bucket
+    download_warm  download the playlist again, everything already stored
+    download_local download the playlist again from the local disk cache
+    lyric_export   fetch and export the SRT lyrics of a playlist
+
+Every scenario runs in its own process, so peak RSS and in-process caches
+belong to it alone. The report has throughput, p50/p99 latency and peak
+RSS per scenario, plus how many weapi calls it made. With --baseline a
+previous report is compared and the run fails on regressions.
+
+    python benchmarks/e2e_bench.py [-s sync_cold] [--tracks 1000]
+        [--latency 0.02] [--output report.json] [--baseline report.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from fake_weapi import PLAYLIST_ID, FakeWeapi
+
+SCENARIOS = [
+    "sync_cold",
+    "sync_warm",
+    "download_cold",
+    "download_warm",
+    "download_local",
+    "lyric_export",
+]
+BENCH_DB = "music-playlist-bench"
+BENCH_BUCKET = "music-playlist-bench"
+
+
+def use_bench_env():
+    """
+    Point the app at the fake weapi and the bench db and bucket. .env is
+    loaded with override, so the settings are patched after it is read and
+    before any module copies them.
+    """
+    db_name = os.environ.get("BENCH_DB", BENCH_DB)
+    bucket = os.environ.get("BENCH_BUCKET", BENCH_BUCKET)
+    if not (db_name.endswith("-bench") and bucket.endswith("-bench")):
+        sys.exit("Refusing to wipe a db or bucket whose name does not end in -bench")
+
+    # app.min_io imports the settings as constants.env, a second copy
+    sys.path.append(os.path.join(ROOT, "app"))
+    import constants.env
+    import app.constants.env
+
+    for env in (constants.env, app.constants.env):
+        env.netease_base_url = os.environ["BENCH_WEAPI_URL"]
+        env.mongo_db_name = db_name
+        env.minio_bucket = bucket
+        # the fake has no rate limit to respect
+        env.netease_rate_limit = env.netease_rate_burst = 1_000_000
+        # only download_local measures the local disk cache
+        env.local_cache_dir = os.environ.get("BENCH_LOCAL_CACHE", "")
+
+    from app.netease import prepare_request
+
+    # encrypt for the fake server's key instead of music.163.com's
+    prepare_request.MODULUS_INT = int(os.environ["BENCH_WEAPI_MODULUS"], 16)
+
+
+def reset():
+    """Empty the bench db, bucket and in-process caches"""
+    from minio.deleteobjects import DeleteObject
+
+    from app.bootstrap import bootstrap
+    from app.min_io.client import BucketName, get_minio_client
+    from app.mongodb.client import DB_NAME, get_client
+    from app.utils.cache import (
+        minio_object_cache,
+        minio_url_cache,
+        netease_url_cache,
+        song_cache,
+    )
+
+    get_client().drop_database(DB_NAME)
+    minio_client = get_minio_client()
+    bucket = BucketName.MUSIC_PLAYLIST.value
+    if minio_client.bucket_exists(bucket):
+        objects = minio_client.list_objects(bucket, recursive=True)
+        errors = minio_client.remove_objects(
+            bucket, (DeleteObject(obj.object_name) for obj in objects)
+        )
+        for error in errors:
+            raise RuntimeError(f"Failed to remove {error.name}: {error.message}")
+    bootstrap()
+    for cache in (song_cache, minio_url_cache, minio_object_cache, netease_url_cache):
+        cache.clear()
+
+
+def new_netease():
+    """
+    A Netease for one asyncio.run. Its async api keeps state bound to the
+    loop it runs on, so every run gets its own.
+    """
+    from app.netease.main import Netease
+
+    return Netease("")
+
+
+def timed(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def download(netease, track_ids: list) -> list:
+    """Download the tracks with netease, which is used for this run only"""
+    from app.mongodb.async_client import close_async_client
+
+    async def run():
+        try:
+            return await netease.download_song(track_ids, save_local=False)
+        finally:
+            await close_async_client()
+
+    results = asyncio.run(run())
+    failed = [result.song_id for result in results if not result.ok]
+    if failed:
+        raise RuntimeError(f"{len(failed)} downloads failed, first {failed[0]}")
+    return results
+
+
+def sync_cold(netease, track_ids: list, rounds: int):
+    samples = []
+    for _ in range(rounds):
+        reset()
+        samples.append(timed(netease.sync_playlist, PLAYLIST_ID))
+    return samples, len(track_ids) * rounds, "sync"
+
+
+def sync_warm(netease, track_ids: list, rounds: int):
+    reset()
+    netease.sync_playlist(PLAYLIST_ID)
+    samples = [timed(netease.sync_playlist, PLAYLIST_ID) for _ in range(rounds)]
+    return samples, len(track_ids) * rounds, "sync"
+
+
+def download_cold(netease, track_ids: list, rounds: int):
+    samples = []
+    for _ in range(rounds):
+        reset()
+        netease.get_songs(track_ids)
+        samples.extend(result.elapsed for result in download(new_netease(), track_ids))
+    return samples, len(track_ids) * rounds, "song"
+
+
+def download_warm(netease, track_ids: list, rounds: int):
+    reset()
+    download(new_netease(), track_ids)
+    samples = [timed(download, new_netease(), track_ids) for _ in range(rounds)]
+    return samples, len(track_ids) * rounds, "playlist"
+
+
+def download_local(netease, track_ids: list, rounds: int):
+    reset()
+    download(new_netease(), track_ids)
+    samples = [timed(download, new_netease(), track_ids) for _ in range(rounds)]
+    return samples, len(track_ids) * rounds, "playlist"
+
+
+def export_lyrics(netease, directory: str, tracks: int) -> dict:
+    """Export the lyrics with netease, which is used for this run only"""
+    from app.mongodb.async_client import close_async_client
+
+    async def run():
+        try:
+            return await netease.export_playlist_lyrics(PLAYLIST_ID, directory)
+        finally:
+            await close_async_client()
+
+    report = asyncio.run(run())
+    # every fake song has a lyric
+    if report["exported"] != tracks:
+        raise RuntimeError(f"{report['exported']} of {tracks} lyrics exported")
+    return report
+
+
+def lyric_export(netease, track_ids: list, rounds: int):
+    samples = []
+    with tempfile.TemporaryDirectory() as directory:
+        for _ in range(rounds):
+            reset()
+            netease.sync_playlist(PLAYLIST_ID)
+            samples.append(
+                timed(export_lyrics, new_netease(), directory, len(track_ids))
+            )
+    return samples, len(track_ids) * rounds, "playlist"
+
+
+def percentile(samples: list, q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run_scenario(name: str, rounds: int) -> dict:
+    """Run one scenario in this process and return its measurements"""
+    use_bench_env()
+    from app.utils.log import logger
+
+    # per-track logs would measure the console, keep warnings only
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    netease = new_netease()
+    track_ids = netease.netease_api.get_playlist(PLAYLIST_ID)[2]
+    start = time.perf_counter()
+    samples, items, unit = globals()[name](netease, track_ids, rounds)
+    elapsed = time.perf_counter() - start
+    return {
+        "scenario": name,
+        "items": items,
+        "seconds": round(elapsed, 3),
+        "throughput": round(items / elapsed, 1),
+        "latency_unit": unit,
+        "p50_ms": round(percentile(samples, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 2),
+        # ru_maxrss is in KiB on linux
+        "peak_rss_mib": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+    }
+
+
+def spawn(name: str, rounds: int, fake: FakeWeapi) -> dict:
+    env = {
+        **os.environ,
+        "BENCH_WEAPI_URL": fake.base_url,
+        "BENCH_WEAPI_MODULUS": format(fake.modulus, "x"),
+    }
+    before = dict(fake.stats)
+    with tempfile.TemporaryDirectory() as local_cache:
+        if name == "download_local":
+            env["BENCH_LOCAL_CACHE"] = local_cache
+        process = subprocess.run(
+            [sys.executable, __file__, "--run", name, "--rounds", str(rounds)],
+            env=env,
+            cwd=ROOT,
+            stdout=subprocess.PIPE,
+            check=True,
+        )
+    report = json.loads(process.stdout.decode().strip().splitlines()[-1])
+    report["weapi_calls"] = {
+        endpoint: count - before.get(endpoint, 0)
+        for endpoint, count in fake.stats.items()
+        if count - before.get(endpoint, 0)
+    }
+    return report
+
+
+def regressions(reports: list, baseline: list, threshold: float) -> list[str]:
+    """Metrics that got more than threshold worse than in baseline"""
+    previous = {report["scenario"]: report for report in baseline}
+    found = []
+    for report in reports:
+        old = previous.get(report["scenario"])
+        if not old:
+            continue
+        for metric, higher_is_better in (
+            ("throughput", True),
+            ("p50_ms", False),
+            ("p99_ms", False),
+            ("peak_rss_mib", False),
+        ):
+            change = (report[metric] - old[metric]) / (old[metric] or 1)
+            if (-change if higher_is_better else change) > threshold:
+                found.append(
+                    f"{report['scenario']} {metric}: {old[metric]} -> {report[metric]}"
+                )
+    return found
+
+
+def print_report(reports: list):
+    print(
+        f"{'scenario':<15} {'items':>6} {'items/s':>9} {'p50 ms':>9} {'p99 ms':>9} "
+        f"{'per':<9} {'rss MiB':>8}  weapi calls"
+    )
+    for r in reports:
+        calls = ", ".join(f"{k}={v}" for k, v in sorted(r["weapi_calls"].items()))
+        print(
+            f"{r['scenario']:<15} {r['items']:>6} {r['throughput']:>9} "
+            f"{r['p50_ms']:>9} {r['p99_ms']:>9} {r['latency_unit']:<9} "
+            f"{r['peak_rss_mib']:>8}  {calls}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "-s", "--scenario", action="append", choices=SCENARIOS, help="default all"
+    )
+    parser.add_argument("--tracks", type=int, default=1000)
+    parser.add_argument("--audio-size", type=int, default=256 * 1024)
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="seconds per fake call"
+    )
+    parser.add_argument(
+        "--bandwidth", type=int, default=0, help="bytes/s per download, 0 unlimited"
+    )
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--output", help="write the report as json")
+    parser.add_argument("--baseline", help="report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_scenario(args.run, args.rounds)))
+        return
+
+    fake = FakeWeapi(args.tracks, args.audio_size, args.latency, args.bandwidth)
+    fake.start()
+    try:
+        reports = [
+            spawn(name, args.rounds, fake) for name in args.scenario or SCENARIOS
+        ]
+    finally:
+        fake.stop()
+    print_report(reports)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(reports, json.load(f), args.threshold)
+        for regression in found:
+            print(f"REGRESSION {regression}")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
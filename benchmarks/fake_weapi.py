@@ -0,0 +1,270 @@
+"""
+Local stand-in for the music.163.com weapi, for benchmarks.
+
+Serves a synthetic catalog: playlists, song details, lyrics, playable urls
+and the audio blobs behind them, with configurable latency, audio size and
+bandwidth. Requests are real prepare_request payloads. The server holds
+its own RSA key, clients encrypt for it once prepare_request.MODULUS_INT
+is set to FakeWeapi.modulus, and every payload is decrypted and parsed the
+way music.163.com would.
+
+    python benchmarks/fake_weapi.py [--port 8800] [--tracks 1000]
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from Crypto.Cipher import AES
+from Crypto.PublicKey import RSA
+from Crypto.Util.Padding import unpad
+
+NONCE = b"0CoJUm6Qyw8W8jud"
+IV = b"0102030405060708"
+PLAYLIST_ID = 1
+FIRST_SONG_ID = 1000000
+LEVELS = {"standard": 128000, "exhigh": 320000, "lossless": 999000, "hires": 1999000}
+
+
+class Catalog:
+    """Deterministic synthetic playlists, songs, lyrics and audio"""
+
+    def __init__(self, tracks: int, audio_size: int, lyric_lines: int = 40):
+        self.track_ids = [FIRST_SONG_ID + i for i in range(tracks)]
+        self.audio_size = audio_size
+        self.lyric_lines = lyric_lines
+        self.update_time = 1700000000000
+
+    def playlist(self, offset: int, limit: int) -> dict:
+        return {
+            "id": PLAYLIST_ID,
+            "name": f"Benchmark {len(self.track_ids)}",
+            "description": "synthetic playlist",
+            "trackCount": len(self.track_ids),
+            "trackUpdateTime": self.update_time,
+            "trackIds": [{"id": id} for id in self.track_ids[offset : offset + limit]],
+        }
+
+    @staticmethod
+    def song(id: int) -> dict:
+        return {
+            "id": id,
+            "name": f"Song {id}",
+            "ar": [
+                {"id": id % 97, "name": f"Singer {id % 97}", "tns": [], "alias": []}
+            ],
+            "al": {
+                "id": id // 10,
+                "name": f"Album {id // 10}",
+                "picUrl": f"https://p1.music.126.net/{id // 10}.jpg",
+                "tns": [],
+            },
+        }
+
+    def lyric(self, id: int) -> str:
+        return "\n".join(
+            f"[{i // 20:02d}:{i * 3 % 60:02d}.{id % 100:02d}]line {i} of song {id}"
+            for i in range(self.lyric_lines)
+        )
+
+    def audio(self, id: int) -> bytes:
+        # flac magic, then bytes that depend on the song only
+        return b"fLaC" + random.Random(id).randbytes(self.audio_size - 4)
+
+    @lru_cache(maxsize=None)
+    def audio_md5(self, id: int) -> str:
+        return hashlib.md5(self.audio(id)).hexdigest()
+
+
+class FakeWeapi:
+    def __init__(
+        self,
+        tracks: int = 1000,
+        audio_size: int = 256 * 1024,
+        latency: float = 0.0,
+        bandwidth: int = 0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        """
+        latency: seconds added to every weapi call and before audio starts
+        bandwidth: bytes per second per audio download, 0 for unlimited
+        """
+        self.catalog = Catalog(tracks, audio_size)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+        self._key = RSA.generate(1024)
+        self._secrets: dict[str, bytes] = {}
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self.base_url = f"http://{host}:{self._server.server_address[1]}"
+        self._thread = None
+
+    @property
+    def modulus(self) -> int:
+        return self._key.n
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def count(self, name: str):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def decrypt(self, params: str, enc_sec_key: str) -> dict:
+        """Undo prepare_request: RSA for the secret key, then two AES layers"""
+        secret = self._secrets.get(enc_sec_key)
+        if secret is None:
+            m = pow(int(enc_sec_key, 16), self._key.d, self._key.n)
+            # rsa_encode reverses the key before encrypting
+            secret = m.to_bytes((m.bit_length() + 7) // 8, "big")[::-1]
+            self._secrets[enc_sec_key] = secret
+        inner = self._aes_decrypt(base64.b64decode(params), secret)
+        return json.loads(self._aes_decrypt(base64.b64decode(inner), NONCE))
+
+    @staticmethod
+    def _aes_decrypt(data: bytes, key: bytes) -> bytes:
+        return unpad(AES.new(key, AES.MODE_CBC, IV).decrypt(data), AES.block_size)
+
+    def weapi(self, path: str, data: dict) -> dict:
+        catalog = self.catalog
+        if path.startswith("/weapi/v6/playlist/detail"):
+            self.count("playlist")
+            if int(data["id"]) != PLAYLIST_ID:
+                return {"code": 404}
+            return {
+                "code": 200,
+                "playlist": catalog.playlist(int(data["offset"]), int(data["limit"])),
+            }
+        if path.startswith("/weapi/v3/song/detail"):
+            self.count("song_detail")
+            return {
+                "code": 200,
+                "songs": [catalog.song(id) for id in json.loads(data["ids"])],
+            }
+        if path.startswith("/weapi/song/lyric"):
+            self.count("lyric")
+            return {"code": 200, "lrc": {"lyric": catalog.lyric(int(data["id"]))}}
+        if path.startswith("/weapi/song/enhance/player/url/v1"):
+            self.count("url")
+            level = data["level"]
+            return {
+                "code": 200,
+                "data": [
+                    {
+                        "id": id,
+                        "url": f"{self.base_url}/audio/{id}.flac",
+                        "br": LEVELS.get(level, 320000),
+                        "size": catalog.audio_size,
+                        "md5": catalog.audio_md5(id),
+                        "type": "flac",
+                        "level": level,
+                        "expi": 1200,
+                    }
+                    for id in data["ids"]
+                ],
+            }
+        return {"code": 404}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive, so pooled sessions reuse connections
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                form = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+                try:
+                    data = fake.decrypt(form["params"], form["encSecKey"])
+                except (KeyError, ValueError) as e:
+                    fake.count("bad_request")
+                    self._send(400, json.dumps({"code": 400, "msg": str(e)}).encode())
+                    return
+                if fake.latency:
+                    time.sleep(fake.latency)
+                result = fake.weapi(urlsplit(self.path).path, data)
+                self._send(200, json.dumps(result).encode(), "application/json")
+
+            def do_GET(self):
+                match = re.fullmatch(r"/audio/(\d+)\.flac", urlsplit(self.path).path)
+                if not match:
+                    self._send(404, b"")
+                    return
+                fake.count("audio")
+                audio = fake.catalog.audio(int(match.group(1)))
+                start = 0
+                range_match = re.fullmatch(
+                    r"bytes=(\d+)-", self.headers.get("Range", "")
+                )
+                if range_match and int(range_match.group(1)) < len(audio):
+                    start = int(range_match.group(1))
+                if fake.latency:
+                    time.sleep(fake.latency)
+                self.send_response(206 if start else 200)
+                self.send_header("Content-Length", str(len(audio) - start))
+                self.send_header("Content-Type", "audio/flac")
+                self.send_header("Accept-Ranges", "bytes")
+                if start:
+                    self.send_header(
+                        "Content-Range", f"bytes {start}-{len(audio) - 1}/{len(audio)}"
+                    )
+                self.end_headers()
+                self._write(memoryview(audio)[start:])
+
+            def _write(self, data: memoryview):
+                chunk = 64 * 1024
+                for i in range(0, len(data), chunk):
+                    self.wfile.write(data[i : i + chunk])
+                    if fake.bandwidth:
+                        time.sleep(chunk / fake.bandwidth)
+
+            def _send(self, status: int, body: bytes, content_type: str = "text/plain"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--tracks", type=int, default=1000)
+    parser.add_argument("--audio-size", type=int, default=256 * 1024)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+    fake = FakeWeapi(args.tracks, args.audio_size, args.latency, port=args.port)
+    print(f"NETEASE_BASE_URL={fake.start()}")
+    print(f"modulus={fake.modulus:x}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
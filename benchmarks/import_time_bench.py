@@ -0,0 +1,58 @@
+"""
+Import-time benchmark for the main.py entry point.
+
+Imports main in fresh interpreters and reports the median wall time, plus
+the slowest modules from the last run's -X importtime output. Importing
+must not touch MinIO or Mongo, so this runs without either service.
+
+    python benchmarks/import_time_bench.py [runs]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_once() -> tuple[float, str]:
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return time.perf_counter() - start, result.stderr
+
+
+def slowest_modules(importtime: str, count: int = 10) -> list[tuple[int, str]]:
+    """Parse -X importtime output into (cumulative us, module) pairs"""
+    modules = []
+    for line in importtime.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        modules.append((int(cumulative), name.strip()))
+    return sorted(modules, reverse=True)[:count]
+
+
+def main(runs: int):
+    timings = []
+    for _ in range(runs):
+        elapsed, importtime = import_once()
+        timings.append(elapsed)
+    print(
+        f"import main: median {statistics.median(timings) * 1000:.1f} ms, "
+        f"min {min(timings) * 1000:.1f} ms over {runs} runs"
+    )
+    print("slowest modules (cumulative):")
+    for cumulative, name in slowest_modules(importtime):
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
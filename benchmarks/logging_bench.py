@@ -0,0 +1,107 @@
+"""
+Cost of per-track logging on the calling thread.
+
+Logs one message per track, like download_song does for a playlist, with
+the app's colorized console format and a rotating log file in a temporary
+directory. The console writes to os.devnull or blocks for a moment on
+every write. Compares synchronous sinks, BackgroundSink sinks, loguru's
+enqueue, sampled item logs and logging turned off. Time is what the
+caller spends, which is what blocks the event loop. Queued records are
+drained after timing.
+
+    python benchmarks/logging_bench.py [tracks]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.log import (
+    BackgroundSink,
+    RotatingFile,
+    SampledLog,
+    log_formatter,
+    logger,
+)
+
+LOG_DIR = tempfile.mkdtemp(prefix="logging-bench-")
+
+
+class SlowConsole:
+    """Console whose reader lags, every write blocks for delay seconds"""
+
+    def __init__(self, delay: float = 0.0002):
+        self.delay = delay
+
+    def write(self, message: str):
+        time.sleep(self.delay)
+
+    def flush(self):
+        pass
+
+
+def configure(mode: str = "sync", console=None):
+    """mode is sync, background or enqueue, for both sinks"""
+    logger.remove()
+    console = console or open(os.devnull, "w")
+    # same rotation as the app's logs/story.log
+    story = RotatingFile(
+        os.path.join(LOG_DIR, "story.log"), 10 * 1024**2, 10 * 24 * 3600
+    )
+    if mode == "background":
+        console, story = BackgroundSink(console), BackgroundSink(story)
+    enqueue = mode == "enqueue"
+    logger.add(
+        console, colorize=True, format=log_formatter, level="INFO", enqueue=enqueue
+    )
+    logger.add(story, colorize=False, level="INFO", enqueue=enqueue)
+
+
+def fstring_logs(tracks: int):
+    for i in range(tracks):
+        name = f"Song {i}"
+        logger.info(f"Downloading song {name} ID:{i}")
+
+
+def lazy_logs(tracks: int):
+    for i in range(tracks):
+        logger.debug("Downloading song {} ID:{}", f"Song {i}", i)
+
+
+def sampled_logs(tracks: int):
+    items = SampledLog("Queued downloads", every=100)
+    for i in range(tracks):
+        items.item("Downloading song {} ID:{}", f"Song {i}", i)
+    items.summary()
+
+
+def bench(name: str, fn, tracks: int):
+    start = time.perf_counter()
+    fn(tracks)
+    elapsed = time.perf_counter() - start
+    # drains queued records
+    logger.remove()
+    print(f"{name:<36} {elapsed * 1000:8.1f} ms {elapsed / tracks * 1e6:8.2f} us/track")
+
+
+def main(tracks: int):
+    for mode in ("sync", "background", "enqueue"):
+        configure(mode)
+        bench(f"{mode} sinks, every track", fstring_logs, tracks)
+    for mode in ("sync", "background", "enqueue"):
+        configure(mode, SlowConsole())
+        bench(f"{mode} sinks, slow console", fstring_logs, tracks)
+    configure("background")
+    bench("background sinks, sampled 1/100", sampled_logs, tracks)
+    configure("background")
+    bench("background sinks, DEBUG filtered", lazy_logs, tracks)
+    bench("logging off", fstring_logs, tracks)
+    shutil.rmtree(LOG_DIR)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
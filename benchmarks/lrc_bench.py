@@ -0,0 +1,75 @@
+"""
+Time to render the SRT files of a large playlist's lyrics.
+
+Generates LRC lyrics like netease's (60 lines, some with several
+timestamps, two digit fractions) and writes one SRT file per song to a
+temporary directory, in this process and across a spawn process pool in
+chunks, as Netease.export_playlist_lyrics does.
+
+    python benchmarks/lrc_bench.py [songs]
+"""
+
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.constants.env import lyric_render_chunk
+from app.netease.lyric import parse_lrc, render_srt_files
+
+
+def lyric(song_id: int, lines: int = 60) -> str:
+    tags = ["[by:bench]", "[offset:0]"]
+    for i in range(lines):
+        stamp = f"[{i * 3 // 60:02d}:{i * 3 % 60:02d}.{song_id % 100:02d}]"
+        if i % 10 == 0:
+            # chorus lines repeat at a second timestamp
+            stamp += f"[{(i * 3 + 90) // 60:02d}:{(i * 3 + 90) % 60:02d}.50]"
+        tags.append(f"{stamp}line {i} of song {song_id}")
+    return "\n".join(tags)
+
+
+def bench(name: str, fn, songs: int):
+    start = time.perf_counter()
+    written = fn()
+    elapsed = time.perf_counter() - start
+    print(
+        f"{name:<28} {elapsed:7.2f} s {songs / elapsed:9.0f} songs/s ({written} written)"
+    )
+
+
+def main(songs: int):
+    lyrics = [lyric(song_id) for song_id in range(songs)]
+    start = time.perf_counter()
+    for text in lyrics:
+        parse_lrc(text)
+    print(f"{'parse only':<28} {time.perf_counter() - start:7.2f} s")
+
+    with tempfile.TemporaryDirectory() as directory:
+        jobs = [
+            (song_id, os.path.join(directory, f"{song_id}.srt"), text)
+            for song_id, text in enumerate(lyrics)
+        ]
+        bench("render, one process", lambda: len(render_srt_files(jobs)), songs)
+
+        chunks = [
+            jobs[i : i + lyric_render_chunk]
+            for i in range(0, len(jobs), lyric_render_chunk)
+        ]
+
+        def pooled():
+            with ProcessPoolExecutor(
+                max_workers=min(os.cpu_count(), len(chunks)),
+                mp_context=multiprocessing.get_context("spawn"),
+            ) as pool:
+                return sum(map(len, pool.map(render_srt_files, chunks)))
+
+        bench(f"render, {os.cpu_count()} processes", pooled, songs)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
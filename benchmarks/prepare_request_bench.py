@@ -0,0 +1,126 @@
+"""
+Microbenchmark for weapi request encryption.
+
+Compares building every request with a fresh key (the old behaviour)
+against drawing keys from a precomputed KeyPool.
+
+The prefilled scenarios time only the request path, with every key
+generated before the timer starts. The steady-state ones send many more
+requests than the default pool holds, so its refill thread has to keep up,
+and report the CPU time of the whole process alongside: with single-use
+keys that is still one RSA modpow per request, only key reuse lowers it.
+
+    python benchmarks/prepare_request_bench.py [iterations]
+"""
+
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.netease.prepare_request import (
+    NONCE,
+    KeyPool,
+    aes_encrypt,
+    create_secret_key,
+    prepare_request,
+    prepare_requests,
+    rsa_encode,
+)
+
+payload = {
+    "csrf_token": "",
+    "id": "5137419858",
+    "offset": 0,
+    "total": True,
+    "limit": 1000,
+    "n": 1000,
+}
+
+
+def fresh_key_request(data):
+    secret_key = create_secret_key(16)
+    params = aes_encrypt(json.dumps(data), NONCE)
+    params = aes_encrypt(params, secret_key)
+    return {"params": params, "encSecKey": rsa_encode(secret_key)}
+
+
+def bench(name, fn, iterations):
+    start = time.perf_counter()
+    cpu = time.process_time()
+    fn()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    print(
+        f"{name:<36} {elapsed / iterations * 1e6:8.1f} us/request"
+        f" {cpu / iterations * 1e6:8.1f} us cpu/request"
+    )
+
+
+def prefilled_pool(iterations: int, **kwargs) -> KeyPool:
+    # Large enough that acquire never drops below the refill mark, so no
+    # background refill competes for the GIL while timing
+    pool = KeyPool(size=2 * iterations + 2, **kwargs)
+    pool.fill()
+    return pool
+
+
+def main(iterations: int):
+    bench(
+        "fresh key per request",
+        lambda: [fresh_key_request(payload) for _ in range(iterations)],
+        iterations,
+    )
+
+    pool = prefilled_pool(iterations)
+    bench(
+        "prefilled pool",
+        lambda: [prepare_request(payload, pool) for _ in range(iterations)],
+        iterations,
+    )
+
+    pool = prefilled_pool(iterations)
+    bench(
+        "prefilled pool, batch",
+        lambda: prepare_requests([payload] * iterations, pool),
+        iterations,
+    )
+
+    pool = prefilled_pool(iterations, max_uses=100)
+    bench(
+        "pool, key reused 100 times",
+        lambda: [prepare_request(payload, pool) for _ in range(iterations)],
+        iterations,
+    )
+
+    # Default pool of 64, filled at startup as NeteaseApi does, then drawn
+    # down far past its size
+    pool = KeyPool()
+    pool.fill()
+    bench(
+        "steady state, default pool",
+        lambda: [prepare_request(payload, pool) for _ in range(iterations)],
+        iterations,
+    )
+
+    pool = KeyPool(max_uses=100)
+    pool.fill()
+    bench(
+        "steady state, key reused 100 times",
+        lambda: [prepare_request(payload, pool) for _ in range(iterations)],
+        iterations,
+    )
+
+    pool = KeyPool(ttl=1.0, max_uses=iterations)
+    pool.fill()
+    bench(
+        "steady state, key reused for 1s",
+        lambda: [prepare_request(payload, pool) for _ in range(iterations)],
+        iterations,
+    )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,86 @@
+"""
+Memory footprint of a playlist catalog held in a worker.
+
+Builds a catalog of synthetic tracks shaped like netease song details and
+measures, with tracemalloc, the memory held by the old song dicts (raw
+singer and album objects, lyric loaded with every song) against Song
+records and an int64 array of track ids.
+
+    python benchmarks/record_memory_bench.py [tracks]
+"""
+
+import os
+import sys
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.mongodb.records import Song, track_id_array
+
+LYRIC = "\n".join(f"[00:{i:02d}.00]lyric line number {i}" for i in range(40))
+
+
+def netease_song(i: int) -> dict:
+    return {
+        "id": 400000000 + i,
+        "name": f"Song {i}",
+        "ar": [
+            {"id": 10000 + i % 500, "name": f"Singer {i % 500}", "tns": [], "alias": []}
+        ],
+        "al": {
+            "id": 30000000 + i // 10,
+            "name": f"Album {i // 10}",
+            "picUrl": f"https://p1.music.126.net/{i // 10:020d}/{i // 10}.jpg",
+            "tns": [],
+            "pic_str": str(109951163000000000 + i // 10),
+            "pic": 109951163000000000 + i // 10,
+        },
+    }
+
+
+def old_record(song: dict, lyric: bool = True) -> dict:
+    """Song document as it used to be stored and read back"""
+    record = {
+        "id": song["id"],
+        "name": song["name"],
+        "singer": dict(song["ar"][0]),
+        "album": dict(song["al"]),
+    }
+    if lyric:
+        # get_song used to read the whole document
+        record["lyric"] = LYRIC + str(song["id"])
+    return record
+
+
+def measure(build) -> int:
+    """Bytes still allocated by what build returns"""
+    tracemalloc.start()
+    held = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del held
+    return size
+
+
+def main(tracks: int):
+    raw = [netease_song(i) for i in range(tracks)]
+    ids = [song["id"] for song in raw]
+
+    results = [
+        ("song dicts with lyrics", measure(lambda: [old_record(s) for s in raw])),
+        (
+            "song dicts without lyrics",
+            measure(lambda: [old_record(s, lyric=False) for s in raw]),
+        ),
+        ("Song records", measure(lambda: [Song.from_netease(s) for s in raw])),
+        # fresh ints, as decoded from a mongo or netease response
+        ("track ids, list", measure(lambda: [int(str(i)) for i in ids])),
+        ("track ids, array", measure(lambda: track_id_array(ids))),
+    ]
+    print(f"{tracks} tracks")
+    for name, size in results:
+        print(f"{name:<28} {size / 1024 / 1024:8.2f} MiB {size / tracks:8.0f} B/track")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
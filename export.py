@@ -0,0 +1,41 @@
+import argparse
+import sys
+
+from app.constants.env import export_concurrency
+from app.export import export_playlist
+from app.utils.log import configure
+from app.utils.metrics import start_exporters
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export the stored audio of a playlist as a tar or zip archive"
+    )
+    parser.add_argument("playlist_id", type=int)
+    parser.add_argument("-o", "--output", default="-", help="file, - for stdout")
+    parser.add_argument("-f", "--format", choices=("tar", "zip"))
+    parser.add_argument("-c", "--concurrency", type=int, default=export_concurrency)
+    args = parser.parse_args()
+    start_exporters()
+
+    archive_format = args.format or ("zip" if args.output.endswith(".zip") else "tar")
+    if args.output == "-":
+        # stdout carries the archive, keep the log off it
+        configure(sys.stderr)
+        result = export_playlist(
+            args.playlist_id,
+            sys.stdout.buffer,
+            archive_format,
+            concurrency=args.concurrency,
+        )
+        sys.stdout.buffer.flush()
+    else:
+        with open(args.output, "wb") as out:
+            result = export_playlist(
+                args.playlist_id, out, archive_format, concurrency=args.concurrency
+            )
+    sys.exit(0 if result else 1)
+
+
+if __name__ == "__main__":
+    main()
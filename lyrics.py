@@ -0,0 +1,43 @@
+import argparse
+import asyncio
+
+from app.bootstrap import bootstrap
+from app.constants.env import lyric_render_processes
+from app.mongodb.async_client import close_async_client
+from app.netease.main import Netease
+from app.utils.metrics import start_exporters
+
+
+async def export(args) -> dict:
+    netease = Netease(args.cookie)
+    try:
+        return await netease.export_playlist_lyrics(
+            args.playlist_id, args.output, args.processes
+        )
+    finally:
+        await close_async_client()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export the lyrics of a playlist as SRT files"
+    )
+    parser.add_argument("playlist_id", type=int)
+    parser.add_argument("-o", "--output", default="lyrics", help="directory")
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        default=lyric_render_processes,
+        help="render processes, 0 for one per cpu",
+    )
+    parser.add_argument("--cookie", default="yun.cookie.txt")
+    args = parser.parse_args()
+    # set_lyrics relies on the unique id index of the lyric collection
+    bootstrap()
+    start_exporters()
+    print(asyncio.run(export(args)))
+
+
+if __name__ == "__main__":
+    main()
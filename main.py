@@ -1,10 +1,18 @@
+from app.bootstrap import bootstrap
+from app.mongodb.async_client import close_async_client
 from app.netease.main import Netease
+from app.utils.metrics import start_exporters
 import asyncio
 
 
 async def main():
+    bootstrap()
+    start_exporters()
     netease = Netease("yun.cookie.txt")
-    await netease.download_song([447925059])
+    try:
+        await netease.download_song([447925059])
+    finally:
+        await close_async_client()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,56 @@
+import argparse
+
+from app.bootstrap import bootstrap
+from app.mongodb.job import enqueue_job, job_counts, retry_dead_jobs
+from app.worker import run_workers
+from app.constants.env import worker_processes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mirror playlists with workers")
+    parser.add_argument("--cookie", default="yun.cookie.txt")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="start worker processes")
+    run.add_argument("-p", "--processes", type=int, default=worker_processes)
+    run.add_argument("--max-jobs", type=int, help="per process, then exit")
+
+    playlist = commands.add_parser("playlist", help="enqueue a playlist mirror")
+    playlist.add_argument("playlist_id", type=int)
+    playlist.add_argument("--quality", default="lossless")
+    playlist.add_argument("--lyrics", action="store_true")
+
+    song = commands.add_parser("song", help="enqueue a song download")
+    song.add_argument("song_ids", type=int, nargs="+")
+    song.add_argument("--quality", default="lossless")
+
+    lyric = commands.add_parser("lyric", help="enqueue lyric fetches")
+    lyric.add_argument("song_ids", type=int, nargs="+")
+
+    commands.add_parser("status", help="count jobs per status")
+    commands.add_parser("retry-dead", help="requeue dead-lettered jobs")
+
+    args = parser.parse_args()
+    bootstrap()
+    if args.command == "run":
+        run_workers(args.cookie, args.processes, args.max_jobs)
+    elif args.command == "playlist":
+        payload = {
+            "playlist_id": args.playlist_id,
+            "quality": args.quality,
+            "lyrics": args.lyrics,
+        }
+        print(enqueue_job("playlist", payload))
+    elif args.command == "song":
+        print(enqueue_job("song", {"song_ids": args.song_ids, "quality": args.quality}))
+    elif args.command == "lyric":
+        for song_id in args.song_ids:
+            print(enqueue_job("lyric", {"song_id": song_id}))
+    elif args.command == "status":
+        print(job_counts())
+    elif args.command == "retry-dead":
+        print(f"Requeued {retry_dead_jobs()} jobs")
+
+
+if __name__ == "__main__":
+    main()